@@ -1,14 +1,123 @@
 import json
+import os
+import time
 import traceback
+from typing import Tuple, Union
 
-import joblib
 import numpy as np
-from flask import Flask, jsonify, request, render_template, Markup
+from flask import Flask, g, jsonify, request, render_template, Markup
+
+from src import ingest
+from src.batcher import PredictionBatcher
+from src.cache import PredictionCache
+from src.metrics import Counter, Gauge, Histogram, MetricsRegistry
+from src.registry import ModelRegistry
+from src.tree_backend import compile_model
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
-model_name = 'model.joblib'
-model = joblib.load(model_name)
+n_features = 25
+
+# 'compiled' predicts tree models with flattened numpy arrays, falls back to native if results differ
+backend = os.environ.get('RAINFALL_BACKEND', 'native')
+
+# model file, or dir of versioned model files where newest is active
+model_name = os.environ.get('RAINFALL_MODEL', 'model.joblib')
+registry = ModelRegistry(
+    path=model_name,
+    poll_interval=float(os.environ.get('RAINFALL_MODEL_POLL', 5)),
+    wrap=(lambda model: compile_model(model, n_features=n_features)) if backend == 'compiled' else None)
+max_batch_rows = 10_000
+
+# coalesce concurrent /predict calls into one model.predict, disabled when max batch size is 1
+max_batch_size = int(os.environ.get('RAINFALL_MAX_BATCH_SIZE', 1))
+max_wait_ms = float(os.environ.get('RAINFALL_MAX_WAIT_MS', 2))
+
+def _predict(x: np.ndarray, model=None, version: str = None) -> np.ndarray:
+    if model is None:
+        model, version = registry.active
+
+    with m_stage.time(stage='predict', model_version=version):
+        return model.predict(x)
+
+def _predict_rows(x: np.ndarray) -> list:
+    """(prediction, version) per row, so each batcher caller gets the version which predicted its row"""
+    model, version = registry.active
+    preds = _predict(x, model=model, version=version)
+
+    m_batches.inc()
+    m_batch_rows.inc(len(preds))
+    return [(pred, version) for pred in preds]
+
+batcher = PredictionBatcher(
+    predict=_predict_rows,
+    max_batch_size=max_batch_size,
+    max_wait=max_wait_ms / 1000) if max_batch_size > 1 else None
+
+# cache repeated /predict inputs, disabled when cache size is 0
+cache_size = int(os.environ.get('RAINFALL_CACHE_SIZE', 1024))
+cache_ttl = float(os.environ.get('RAINFALL_CACHE_TTL', 300))
+
+cache = PredictionCache(
+    maxsize=cache_size,
+    ttl=cache_ttl) if cache_size > 0 else None
+
+if not cache is None:
+    registry.on_change(lambda version: cache.clear())
+
+# in-process prometheus style metrics, served from /metrics
+metrics = MetricsRegistry()
+m_requests = metrics.add(Counter(
+    'rainfall_requests_total', 'HTTP requests by endpoint and status',
+    labelnames=('endpoint', 'status', 'model_version')))
+m_errors = metrics.add(Counter(
+    'rainfall_errors_total', 'Error responses by endpoint and error type',
+    labelnames=('endpoint', 'error', 'status')))
+m_latency = metrics.add(Histogram(
+    'rainfall_request_seconds', 'Total request latency',
+    labelnames=('endpoint', 'model_version')))
+m_stage = metrics.add(Histogram(
+    'rainfall_stage_seconds', 'Time per prediction stage (parse, validate, array, cache, predict)',
+    labelnames=('stage', 'model_version')))
+m_model = metrics.add(Gauge(
+    'rainfall_model_info', 'Active model version',
+    labelnames=('version', )))
+m_cache = metrics.add(Counter(
+    'rainfall_cache_lookups_total', 'Prediction cache lookups by result',
+    labelnames=('result', )))
+m_cache_size = metrics.add(Gauge(
+    'rainfall_cache_entries', 'Predictions currently cached'))
+m_batches = metrics.add(Counter(
+    'rainfall_batches_total', 'Coalesced model.predict calls'))
+m_batch_rows = metrics.add(Counter(
+    'rainfall_batched_rows_total', 'Rows predicted in coalesced model.predict calls'))
+m_batch_pending = metrics.add(Gauge(
+    'rainfall_batcher_pending_rows', 'Rows waiting to join a coalesced batch'))
+
+def _timer(stage: str):
+    return m_stage.time(stage=stage, model_version=registry.version)
+
+def observe_request(endpoint: str, status: int, secs: float):
+    """Record request count and latency, shared by flask and asgi servers"""
+    version = registry.version
+    m_requests.inc(endpoint=endpoint, status=status, model_version=version)
+    m_latency.observe(secs, endpoint=endpoint, model_version=version)
+
+def observe_error(endpoint: str, err: Exception, status: int):
+    m_errors.inc(endpoint=endpoint, error=type(err).__name__, status=status)
+
+def metrics_text() -> str:
+    """Render all metrics, refreshing gauges read from other objects first"""
+    m_model.clear()
+    m_model.set(1, version=registry.version)
+
+    if not cache is None:
+        m_cache_size.set(len(cache))
+
+    if not batcher is None:
+        m_batch_pending.set(batcher.pending)
+
+    return metrics.render()
 
 class APIError(Exception):
     """Custom known error"""
@@ -16,15 +125,32 @@ class APIError(Exception):
         super().__init__(*args, **kw)
         self.code = 400
 
+def _endpoint() -> str:
+    """Matched route for metrics labels, so unknown paths don't add new label values"""
+    return request.url_rule.rule if not request.url_rule is None else 'unmatched'
+
+@app.before_request
+def start_timer():
+    g.t_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if 't_start' in g:
+        observe_request(_endpoint(), response.status_code, time.perf_counter() - g.t_start)
+
+    return response
+
 @app.errorhandler(APIError)
 def handle_exception(err):
     """Handle known exceptions (eg incorrect input)"""
+    observe_error(_endpoint(), err, err.code)
     response = dict(error=str(err))
     return jsonify(response), err.code
 
 @app.errorhandler(500)
 def handle_exception(err):
     """Handle all other errors"""
+    observe_error(_endpoint(), getattr(err, 'original_exception', None) or err, 500)
     app.logger.error(f'Unknown Exception: {str(err)}')
     tb = traceback.format_exception(etype=type(err), value=err, tb=err.__traceback__)
     app.logger.debug(''.join(tb))
@@ -36,18 +162,18 @@ def handle_exception(err):
     return jsonify(response), 500
 
 
-def return_prediction(input_vals: list) -> float:
-    """Return model prediction
+def return_prediction(input_vals: Union[list, np.ndarray]) -> Tuple[float, str]:
+    """Return model prediction and version of model which made it
 
     Parameters
     ----------
-    input_vals : list
-        list of length 25 for model to predict
+    input_vals : Union[list, np.ndarray]
+        list or float64 array of length 25 for model to predict
 
     Returns
     -------
-    float
-        model's predicted value
+    Tuple[float, str]
+        model's predicted value, model version
 
     Raises
     ------
@@ -55,19 +181,201 @@ def return_prediction(input_vals: list) -> float:
         incorrect input type
     APIError
         wrong length list
+    APIError
+        non-numeric values
+    APIError
+        values outside 0-250
     """    
-    if not isinstance(input_vals, list):
+    if not isinstance(input_vals, (list, np.ndarray)):
         raise APIError(
             f'Input must be of type list|ndarray, you input: ({type(input_vals)}, {input_vals})')
     
     len_vals = len(input_vals)
-    if not len_vals == 25:
+    if not len_vals == n_features:
         raise APIError(
-            f'Input array must be of length 25, your array length: {len_vals}'
+            f'Input array must be of length {n_features}, your array length: {len_vals}'
         )
 
-    x = np.array(input_vals).reshape(1, len(input_vals))
-    return model.predict(x)[0]
+    # read once, so response version, prediction and cache key all match even if model reloads mid request
+    model, version = registry.active
+
+    # cached inputs have already passed validation
+    with _timer('cache'):
+        key = cache.make_key(input_vals) if not cache is None else None
+        pred = cache.get((version, key)) if not key is None else None
+
+    if not key is None:
+        m_cache.inc(result='miss' if pred is None else 'hit')
+
+    if not pred is None:
+        return pred, version
+
+    # reject bad input before it joins a coalesced batch, so it can't fail other callers' rows
+    with _timer('array'):
+        x = input_vals if isinstance(input_vals, np.ndarray) else ingest.to_array(input_vals)
+
+    if x is None:
+        raise APIError(f'Input array must only contain numbers, you input: {input_vals}')
+
+    try:
+        with _timer('validate'):
+            ingest.check_array(x, n_features=n_features, ndim=1)
+    except ValueError as e:
+        raise APIError(str(e))
+
+    if not batcher is None:
+        pred, version = batcher.predict(x)
+    else:
+        pred = _predict(x.reshape(1, len(input_vals)), model=model, version=version)[0]
+
+    # entries of a replaced version are never read again, and age out of the lru
+    if not key is None:
+        cache.put((version, key), pred)
+
+    return pred, version
+
+def return_predictions(x: np.ndarray) -> Tuple[np.ndarray, str]:
+    """Return model predictions for a batch of inputs with a single model.predict call, and model version
+
+    Parameters
+    ----------
+    x : np.ndarray
+        array of shape (n, 25) for model to predict
+
+    Returns
+    -------
+    Tuple[np.ndarray, str]
+        model's predicted values in input row order, model version
+
+    Raises
+    ------
+    APIError
+        wrong dtype, shape or number of rows
+    APIError
+        values outside 0-250
+    """
+    try:
+        with _timer('validate'):
+            ingest.check_array(x, n_features=n_features, ndim=2)
+    except ValueError as e:
+        raise APIError(str(e))
+
+    n_rows = x.shape[0]
+    if not 0 < n_rows <= max_batch_rows:
+        raise APIError(
+            f'Input batch must have between 1 and {max_batch_rows} rows, your batch rows: {n_rows}')
+
+    model, version = registry.active
+    return _predict(x, model=model, version=version), version
+
+def batch_array(data: bytes, mimetype: str) -> np.ndarray:
+    """Read (n, 25) float64 array from request body
+    - application/octet-stream: raw little-endian float64 values, row-major
+    - application/json: {"data": [[25 values], ...]}
+
+    Returns
+    -------
+    np.ndarray
+
+    Raises
+    ------
+    APIError
+        body can't be read as float array
+    """
+    try:
+        with _timer('parse'):
+            if mimetype == 'application/octet-stream':
+                return ingest.parse_binary(data, n_features=n_features)
+
+            return ingest.parse_json(data)
+    except ValueError as e:
+        raise APIError(str(e))
+
+def binary_input(data: bytes) -> np.ndarray:
+    """Read single row of 25 raw little-endian float64 values from request body"""
+    try:
+        with _timer('parse'):
+            x = ingest.parse_binary(data, n_features=n_features)
+    except ValueError as e:
+        raise APIError(str(e))
+
+    if not x.shape[0] == 1:
+        raise APIError(f'Binary input must be a single row, use /predict_batch for {x.shape[0]} rows')
+
+    return x[0]
+
+def json_content(data: bytes, mimetype: str):
+    """Decode JSON request body, or None if not a JSON request"""
+    is_json = mimetype == 'application/json' \
+        or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+    if not is_json:
+        return None
+
+    try:
+        with _timer('parse'):
+            return ingest.loads(data)
+    except ValueError as e:
+        raise APIError(str(e))
+
+def predict_results(data: bytes, mimetype: str) -> dict:
+    """/predict response for raw request body, shared by flask and asgi servers
+
+    Parameters
+    ----------
+    data : bytes
+        raw request body
+    mimetype : str
+        request content type without params, eg 'application/json'
+
+    Returns
+    -------
+    dict
+        results to return as json
+    """
+    if mimetype == 'application/octet-stream':
+        x = binary_input(data)
+        predicted_rainfall, version = return_prediction(input_vals=x)
+
+        return dict(
+            predicted_rainfall=f'{predicted_rainfall:.2f}mm',
+            input_vals=x.tolist(),
+            model_version=version)
+
+    content = json_content(data, mimetype)
+    input_vals = None
+
+    if not content is None:
+        if isinstance(content, dict) and len(content) > 0:
+            input_vals = list(content.values())[0]
+        else:
+            raise APIError('Input data incorrect format.')
+    else:
+        raise APIError('Missing input data.')
+
+    # allow blank input, just use random numbers for input_vals
+    if (
+        input_vals is None
+        or (isinstance(input_vals, list) and len(input_vals) == 0)):
+
+        input_vals = np.random.randint(0, 250, 25).tolist()
+
+    predicted_rainfall, version = return_prediction(input_vals=input_vals)
+
+    return dict(
+        predicted_rainfall=f'{predicted_rainfall:.2f}mm',
+        input_vals=input_vals,
+        model_version=version)
+
+def predict_batch_results(data: bytes, mimetype: str) -> dict:
+    """/predict_batch response for raw request body, shared by flask and asgi servers"""
+    x = batch_array(data, mimetype)
+    predicted_rainfall, version = return_predictions(x=x)
+
+    return dict(
+        predicted_rainfall=np.round(predicted_rainfall, 2).tolist(),
+        n_rows=len(predicted_rainfall),
+        model_version=version)
 
 @app.route("/")
 def index():
@@ -83,7 +391,19 @@ def index():
     <pre>curl -X POST http://<ec2_ip_address>:8080/predict -d '{"data":[1,2,3,4,53,11,22,37,41,53,11,24,31,44,53,11,22,35,42,53,12,23,31,42,53]} -H "Content-Type: application/json"<br>
 {
     "input_vals": [1, 2, 3, 4, 53, 11, 22, 37, 41, 53, 11, 24, 31, 44, 53, 11, 22, 35, 42, 53, 12, 23, 31, 42, 53], 
+    "model_version": "model-3f2a9b1c",
     "predicted_rainfall": "31.59mm"
+}</pre><br>
+
+    To predict many rows at once, post an N&times;25 array to <code>/predict_batch</code>, either as JSON or as raw little-endian float64 bytes with <code>Content-Type: application/octet-stream</code>.<br>
+    Predictions are returned in input row order.<br><br>
+
+    eg:
+    <pre>curl -X POST http://<ec2_ip_address>:8080/predict_batch -d '{"data":[[1,2,3,...],[4,5,6,...]]}' -H "Content-Type: application/json"<br>
+{
+    "model_version": "model-3f2a9b1c",
+    "n_rows": 2,
+    "predicted_rainfall": [31.59, 12.04]
 }</pre><br><br>
     """)
     
@@ -94,28 +414,14 @@ def index():
 
 @app.route('/predict', methods=['GET', 'POST'])
 def rainfall_prediction():
-    content = request.json
-    input_vals = None
-
-    if not content is None:
-        if isinstance(content, dict) and len(content) > 0:
-            input_vals = list(content.values())[0]
-        else:
-            raise APIError('Input data incorrect format.')
-    else:
-        raise APIError('Missing input data.')
-
-    # allow blank input, just use random numbers for input_vals
-    if (
-        input_vals is None
-        or (isinstance(input_vals, list) and len(input_vals) == 0)):
-
-        input_vals = np.random.randint(0, 250, 25).tolist()
-
-    predicted_rainfall = return_prediction(input_vals=input_vals)
-
-    results = dict(
-        predicted_rainfall=f'{predicted_rainfall:.2f}mm',
-        input_vals=input_vals)
+    results = predict_results(data=request.get_data(), mimetype=request.mimetype)
+    return jsonify(results), 200
 
+@app.route('/predict_batch', methods=['POST'])
+def rainfall_prediction_batch():
+    results = predict_batch_results(data=request.get_data(), mimetype=request.mimetype)
     return jsonify(results), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return metrics_text(), 200, {'Content-Type': metrics.content_type}
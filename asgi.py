@@ -0,0 +1,181 @@
+"""
+ASGI serving mode for the rainfall prediction service
+
+Same `/`, `/predict` and `/predict_batch` routes, request/response contract and APIError
+semantics as the flask app in app.py, but request bodies are read on the event loop and
+model inference runs in a bounded thread pool, so slow clients never hold an inference worker.
+
+Examples
+--------
+>>> uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import app as flask_app
+from app import APIError
+from src import getlog
+
+log = getlog(__name__)
+
+# max threads running inference, and max requests waiting for a thread before new ones queue on the loop
+n_workers = int(os.environ.get('RAINFALL_ASGI_WORKERS', os.cpu_count() or 1))
+max_pending = int(os.environ.get('RAINFALL_ASGI_MAX_PENDING', n_workers * 4))
+max_body_mb = float(os.environ.get('RAINFALL_ASGI_MAX_BODY_MB', 16))
+
+routes = {
+    '/predict': (('GET', 'POST'), flask_app.predict_results),
+    '/predict_batch': (('POST', ), flask_app.predict_batch_results)}
+
+
+class App(object):
+    """Minimal ASGI app wrapping the shared prediction functions from app.py"""
+
+    def __init__(self, n_workers: int = n_workers, max_pending: int = max_pending):
+        self.n_workers = n_workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='inference')
+        self._index = None
+        self._sem = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if not scope['type'] == 'http':
+            return
+
+        # semaphore must be created inside running loop
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_pending)
+
+        path, method = scope['path'], scope['method']
+
+        if path == '/metrics' and method == 'GET':
+            body = flask_app.metrics_text().encode()
+            return await self.send_response(send, 200, body, content_type=flask_app.metrics.content_type.encode())
+
+        if path == '/' and method in ('GET', 'HEAD'):
+            return await self.send_response(send, 200, self.index(), content_type=b'text/html; charset=utf-8')
+
+        if path.startswith('/static/') and method in ('GET', 'HEAD'):
+            return await self.send_static(send, path)
+
+        if not path in routes:
+            return await self.send_json(send, 404, dict(error=f'Not found: {path}'))
+
+        methods, func = routes[path]
+        if not method in methods:
+            return await self.send_json(send, 405, dict(error=f'Method {method} not allowed for {path}'))
+
+        t = time.perf_counter()
+        data = await self.read_body(receive)
+        if data is None:
+            return await self.send_json(send, 413, dict(error=f'Request body larger than {max_body_mb}mb'))
+
+        mimetype = self.mimetype(scope)
+
+        try:
+            async with self._sem:
+                results = await asyncio.get_running_loop() \
+                    .run_in_executor(self.pool, func, data, mimetype)
+
+            status = 200
+        except APIError as err:
+            status, results = err.code, dict(error=str(err))
+            flask_app.observe_error(path, err, status)
+        except Exception as err:
+            log.error(f'Unknown Exception: {str(err)}')
+            status = 500
+            results = dict(
+                error='Sorry, an unknown exception occurred',
+                description=str(err))
+            flask_app.observe_error(path, err, status)
+
+        await self.send_json(send, status, results)
+        flask_app.observe_request(path, status, time.perf_counter() - t)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send(dict(type='lifespan.startup.complete'))
+            elif message['type'] == 'lifespan.shutdown':
+                self.pool.shutdown(wait=True)
+                await send(dict(type='lifespan.shutdown.complete'))
+                return
+
+    async def read_body(self, receive) -> bytes:
+        """Read full request body, or None if over size limit"""
+        max_bytes = max_body_mb * 1024 * 1024
+        chunks, size = [], 0
+
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > max_bytes:
+                return None
+
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+
+        return b''.join(chunks)
+
+    @staticmethod
+    def mimetype(scope) -> str:
+        """Content type header without params, eg 'application/json'"""
+        for k, v in scope['headers']:
+            if k == b'content-type':
+                return v.decode('latin-1').split(';')[0].strip().lower()
+
+        return ''
+
+    def index(self) -> bytes:
+        """Render flask index page once, it never changes"""
+        if self._index is None:
+            with flask_app.app.test_request_context('/'):
+                html, _ = flask_app.index()
+
+            self._index = html.encode()
+
+        return self._index
+
+    async def send_static(self, send, path: str):
+        """Serve files from flask app's static folder, eg style.css"""
+        p_static = Path(flask_app.app.static_folder).resolve()
+        p = (p_static / path[len('/static/'):]).resolve()
+
+        if not (p_static in p.parents and p.is_file()):
+            return await self.send_json(send, 404, dict(error=f'Not found: {path}'))
+
+        content_type = (mimetypes.guess_type(p.name)[0] or 'application/octet-stream').encode()
+        await self.send_response(send, 200, p.read_bytes(), content_type=content_type)
+
+    async def send_json(self, send, status: int, results: dict):
+        body = json.dumps(results, sort_keys=True).encode()
+        await self.send_response(send, status, body, content_type=b'application/json')
+
+    async def send_response(self, send, status: int, body: bytes, content_type: bytes):
+        await send(dict(
+            type='http.response.start',
+            status=status,
+            headers=[
+                (b'content-type', content_type),
+                (b'content-length', str(len(body)).encode())]))
+
+        await send(dict(type='http.response.body', body=body))
+
+
+app = App()
@@ -0,0 +1,238 @@
+"""
+Compare end to end time and peak disk usage of download + unzip methods for a zip like data.zip
+
+- original: single streamed GET with iter_content, then shutil unpack_archive, as download_file
+  and unzip did before ranged downloads were added (speedups are relative to this)
+- one_range: download_file with one range at a time, then shutil unpack_archive
+- parallel: download_file with parallel ranges, then unzip members in parallel threads
+- stream: download_unzip style unzip_url, members extracted from range requests while the rest
+  of the archive downloads, zip never written to disk
+
+Serves a synthetic zip of rainfall-like csvs from a local range capable http server. Use
+--mbps to throttle each connection and approximate a real network link.
+
+Examples
+--------
+>>> python benchmarks/bench_download.py --files 28 --mb 200 --mbps 50
+"""
+
+import argparse
+import http.server
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import requests
+from tqdm import tqdm
+
+sys.path.append(str(Path(__file__).parents[1]))
+
+from src import download as dl
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler supporting single byte range requests, optionally throttled"""
+    protocol_version = 'HTTP/1.1'
+    mbps = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        p = Path(self.translate_path(self.path))
+        if not p.is_file():
+            return self.send_error(404)
+
+        size = p.stat().st_size
+        m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+
+        if m:
+            start, end = int(m.group(1)), min(int(m.group(2) or size - 1), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            start, end = 0, size - 1
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        chunk_size = 64 * 1024
+        with open(p, 'rb') as file:
+            file.seek(start)
+            remaining = end - start + 1
+
+            while remaining > 0:
+                data = file.read(min(chunk_size, remaining))
+                self.wfile.write(data)
+                remaining -= len(data)
+
+                if self.mbps > 0:
+                    time.sleep(len(data) / (self.mbps * 1024 * 1024))
+
+
+def serve(p_dir: Path, mbps: float = 0) -> http.server.ThreadingHTTPServer:
+    handler = type('Handler', (RangeHandler, ), dict(mbps=mbps))
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0),
+        lambda *args, **kw: handler(*args, directory=str(p_dir), **kw))
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_zip(p: Path, n_files: int, mb: float, seed: int = 0) -> Path:
+    """Zip of n_files csvs with columns like the raw rainfall data, about mb uncompressed in total"""
+    rng = np.random.default_rng(seed)
+    n_rows = int(mb * 1024 * 1024 / n_files / 60)
+    header = 'time,lat_min,lat_max,lon_min,lon_max,rain (mm/day)\n'
+
+    with zipfile.ZipFile(p, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for i in range(n_files):
+            vals = np.column_stack([
+                rng.uniform(-35, -30, (n_rows, 2)).round(4),
+                rng.uniform(140, 150, (n_rows, 2)).round(4),
+                rng.exponential(2, n_rows).round(6)])
+
+            body = '\n'.join(
+                f'1889-01-{1 + j % 28:02d} 12:00:00,' + ','.join(map(str, row)) for j, row in enumerate(vals))
+
+            zf.writestr(f'model_{i:02d}_daily_rainfall_NSW.csv', header + body + '\n')
+
+    return p
+
+
+class DiskSampler(object):
+    """Track peak allocated bytes of all files under p_dir in background thread"""
+
+    def __init__(self, p_dir: Path, interval: float = 0.02):
+        self.p_dir = p_dir
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def usage(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.p_dir):
+            for name in files:
+                try:
+                    # allocated blocks, so preallocated sparse .part files only count what's written
+                    total += os.stat(os.path.join(root, name)).st_blocks * 512
+                except FileNotFoundError:
+                    pass
+
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.usage())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.usage())
+
+
+def original(url: str, p_dir: Path, workers: int, part_size: int):
+    """Single stream download + unpack, same as download_file/unzip before parallel ranges"""
+    p = p_dir / 'data.zip'
+    chunk_size = 1024 * 1024
+
+    resp = requests.get(url, stream=True, allow_redirects=True)
+    progress_bar = tqdm(total=int(resp.headers.get('content-length', 0)), unit='iB', unit_scale=True)
+
+    with open(p, 'wb') as file:
+        for data in resp.iter_content(chunk_size=chunk_size):
+            progress_bar.update(len(data))
+            if data:
+                file.write(data)
+
+    progress_bar.close()
+    shutil.unpack_archive(p, p_dir / 'csv')
+    p.unlink()
+
+
+def one_range(url: str, p_dir: Path, workers: int, part_size: int):
+    p = dl.download_file(url=url, name='data.zip', workers=1, part_size=part_size, overwrite=True)
+    dl.unzip(p=p, p_dst='csv', delete=True)
+
+
+def parallel(url: str, p_dir: Path, workers: int, part_size: int):
+    p = dl.download_file(url=url, name='data.zip', workers=workers, part_size=part_size, overwrite=True)
+    dl.unzip(p=p, p_dst='csv', delete=True, workers=workers)
+
+
+def stream(url: str, p_dir: Path, workers: int, part_size: int):
+    dl.unzip_url(url=url, p_dst=p_dir / 'csv', workers=workers)
+
+
+def run(n_files: int, mb: float, mbps: float, workers: int, part_size: int) -> list:
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        p_srv = Path(tmp) / 'srv'
+        p_srv.mkdir()
+        p_zip = make_zip(p_srv / 'data.zip', n_files=n_files, mb=mb)
+        zip_mb = p_zip.stat().st_size / 1024 / 1024
+
+        server = serve(p_srv, mbps=mbps)
+        url = f'http://127.0.0.1:{server.server_port}/data.zip'
+
+        try:
+            for name, func in (('original', original), ('one_range', one_range), ('parallel', parallel), ('stream', stream)):
+                p_dir = Path(tmp) / name
+                p_dir.mkdir()
+                dl.p_data = p_dir
+
+                with DiskSampler(p_dir) as sampler:
+                    t = time.perf_counter()
+                    func(url=url, p_dir=p_dir, workers=workers, part_size=part_size)
+                    secs = time.perf_counter() - t
+
+                results.append(dict(
+                    method=name,
+                    secs=secs,
+                    zip_mb=zip_mb,
+                    peak_disk_mb=sampler.peak / 1024 / 1024,
+                    final_disk_mb=sampler.usage() / 1024 / 1024))
+        finally:
+            server.shutdown()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--files', type=int, default=28, help='csv files in zip')
+    parser.add_argument('--mb', type=float, default=200, help='total uncompressed csv size')
+    parser.add_argument('--mbps', type=float, default=0, help='per connection throttle, 0 for none')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--part-size', type=int, default=16, help='range size in mb for downloads')
+    args = parser.parse_args()
+
+    results = run(n_files=args.files, mb=args.mb, mbps=args.mbps, workers=args.workers, part_size=args.part_size)
+    base = results[0]['secs']
+
+    print(f'{"method":<12} {"zip_mb":>8} {"secs":>8} {"speedup":>8} {"peak_disk_mb":>13} {"final_disk_mb":>14}')
+    for r in results:
+        print(
+            f'{r["method"]:<12} {r["zip_mb"]:>8.1f} {r["secs"]:>8.2f} {base / r["secs"]:>7.1f}x '
+            f'{r["peak_disk_mb"]:>13.1f} {r["final_disk_mb"]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
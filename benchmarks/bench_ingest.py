@@ -0,0 +1,102 @@
+"""
+Compare request body parsing cost for /predict and /predict_batch payloads
+
+- baseline: json.loads -> python list -> isinstance/len checks -> np.array (original /predict path)
+- fast_json: src.ingest.parse_json (orjson if installed) to float64 + vectorized check_array
+- binary: src.ingest.parse_binary zero copy view + vectorized check_array
+
+Examples
+--------
+>>> python benchmarks/bench_ingest.py --rows 1 1000 --number 2000
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parents[1]))
+
+from src import ingest
+
+n_features = 25
+
+
+def baseline(data: bytes) -> np.ndarray:
+    content = json.loads(data)
+    input_vals = list(content.values())[0]
+
+    if not isinstance(input_vals, list):
+        raise ValueError('Input must be of type list')
+
+    rows = input_vals if isinstance(input_vals[0], list) else [input_vals]
+    if not all(len(row) == n_features for row in rows):
+        raise ValueError('Wrong length')
+
+    return np.array(input_vals)
+
+
+def fast_json(data: bytes) -> np.ndarray:
+    x = ingest.parse_json(data)
+    return ingest.check_array(x, n_features=n_features, ndim=x.ndim)
+
+
+def binary(data: bytes) -> np.ndarray:
+    x = ingest.parse_binary(data, n_features=n_features)
+    return ingest.check_array(x, n_features=n_features, ndim=2)
+
+
+def make_payloads(n_rows: int, seed: int = 0) -> dict:
+    """JSON and binary bodies for same random (n_rows, 25) input"""
+    x = np.random.default_rng(seed).integers(0, 250, (n_rows, n_features)).astype(np.float64)
+    vals = x[0].tolist() if n_rows == 1 else x.tolist()
+
+    return dict(
+        json=json.dumps(dict(data=vals)).encode(),
+        binary=x.tobytes())
+
+
+def run(rows: list, number: int) -> list:
+    results = []
+
+    for n_rows in rows:
+        payloads = make_payloads(n_rows)
+        n = max(number // n_rows, 10)
+
+        for name, func, body in (
+                ('baseline', baseline, payloads['json']),
+                ('fast_json', fast_json, payloads['json']),
+                ('binary', binary, payloads['binary'])):
+
+            secs = min(timeit.repeat(lambda: func(body), number=n, repeat=5)) / n
+            results.append(dict(
+                rows=n_rows,
+                method=name,
+                body_bytes=len(body),
+                us_per_request=secs * 1e6,
+                us_per_row=secs * 1e6 / n_rows))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--number', type=int, default=5000, help='rows parsed per timing repeat')
+    args = parser.parse_args()
+
+    results = run(rows=args.rows, number=args.number)
+    base = {r['rows']: r['us_per_request'] for r in results if r['method'] == 'baseline'}
+
+    print(f'{"rows":>6} {"method":<10} {"bytes":>9} {"us/req":>10} {"us/row":>8} {"speedup":>8}')
+    for r in results:
+        print(
+            f'{r["rows"]:>6} {r["method"]:<10} {r["body_bytes"]:>9,} {r["us_per_request"]:>10.1f} '
+            f'{r["us_per_row"]:>8.2f} {base[r["rows"]] / r["us_per_request"]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
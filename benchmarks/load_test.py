@@ -0,0 +1,293 @@
+"""
+Load test and latency benchmark for the prediction service
+
+Starts app.py (flask) or asgi.py (uvicorn) in a subprocess with a stand-in model, drives it
+with concurrent keep-alive clients and a weighted mix of payloads, then reports throughput
+and p50/p95/p99 latency per payload kind. Results are written to json so runs can be diffed
+when the model, serialization or server changes.
+
+Payload kinds
+- single: one random row of 25 values to /predict
+- empty: empty list to /predict, server predicts random values
+- invalid: wrong length row to /predict, expects 400
+- batch: --batch-rows random rows to /predict_batch
+
+Examples
+--------
+>>> python benchmarks/load_test.py --server flask --concurrency 8 --duration 20
+>>> python benchmarks/load_test.py --server asgi --mix single=0.7,empty=0.1,invalid=0.1,batch=0.1 --out results.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+p_root = Path(__file__).parents[1]
+n_features = 25
+
+# status code each payload kind should return
+expected_status = dict(single=200, empty=200, invalid=400, batch=200)
+
+
+def make_model(p: Path, n_estimators: int = 50, max_depth: int = 3) -> Path:
+    """Fit small stand-in model shaped like the deployed one, save with joblib"""
+    import joblib
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 250, (2000, n_features))
+    y = x.mean(axis=1) + rng.normal(0, 5, 2000)
+
+    model = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth, random_state=0) \
+        .fit(x, y)
+
+    joblib.dump(model, p)
+    return p
+
+
+def make_payload(kind: str, rng: random.Random, batch_rows: int) -> tuple:
+    """Return (path, body, content_type) for payload kind"""
+    if kind == 'single':
+        data = [rng.randint(0, 250) for _ in range(n_features)]
+    elif kind == 'empty':
+        data = []
+    elif kind == 'invalid':
+        data = [rng.randint(0, 250) for _ in range(n_features - 1)]
+    elif kind == 'batch':
+        data = [[rng.randint(0, 250) for _ in range(n_features)] for _ in range(batch_rows)]
+        return '/predict_batch', json.dumps(dict(data=data)).encode(), 'application/json'
+    else:
+        raise ValueError(f'Unknown payload kind: {kind}')
+
+    return '/predict', json.dumps(dict(data=data)).encode(), 'application/json'
+
+
+def parse_mix(s: str) -> dict:
+    """'single=0.8,invalid=0.2' -> {'single': 0.8, 'invalid': 0.2}"""
+    mix = {}
+    for item in s.split(','):
+        kind, weight = item.split('=')
+        if not kind in expected_status:
+            raise ValueError(f'Unknown payload kind: {kind}, must be one of {list(expected_status)}')
+
+        mix[kind.strip()] = float(weight)
+
+    return mix
+
+
+def start_server(server: str, port: int, p_model: Path, env: dict = None) -> subprocess.Popen:
+    """Start app in subprocess and wait until it answers on /"""
+    env = {**os.environ, **(env or {}), 'RAINFALL_MODEL': str(p_model), 'PYTHONPATH': str(p_root)}
+
+    if server == 'flask':
+        code = f'from app import app; app.run(host="127.0.0.1", port={port}, threaded=True)'
+        args = [sys.executable, '-c', code]
+    elif server == 'asgi':
+        args = [
+            sys.executable, '-m', 'uvicorn', 'asgi:app',
+            '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    else:
+        raise ValueError(f'Unknown server: {server}')
+
+    proc = subprocess.Popen(
+        args,
+        cwd=p_root,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'{server} server exited with code {proc.returncode}')
+
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+
+    proc.kill()
+    raise RuntimeError(f'{server} server did not start within 60s')
+
+
+def worker(port: int, mix: dict, stop: float, batch_rows: int, seed: int, records: list):
+    """Send requests on one keep-alive connection until stop time, append (kind, status, secs)"""
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    while time.perf_counter() < stop:
+        kind = rng.choices(kinds, weights)[0]
+        path, body, content_type = make_payload(kind, rng=rng, batch_rows=batch_rows)
+
+        t = time.perf_counter()
+        try:
+            conn.request('POST', path, body=body, headers={'Content-Type': content_type})
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            status = 0
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+        records.append((kind, status, time.perf_counter() - t))
+
+    conn.close()
+
+
+def summarize(records: list, secs: float) -> dict:
+    """Throughput and latency percentiles (ms) per payload kind and overall"""
+    def stats(rows):
+        lat = np.array([r[2] for r in rows]) * 1000
+        unexpected = sum(not r[1] == expected_status[r[0]] for r in rows)
+
+        return dict(
+            requests=len(rows),
+            rps=len(rows) / secs,
+            unexpected_status=unexpected,
+            mean_ms=float(lat.mean()),
+            p50_ms=float(np.percentile(lat, 50)),
+            p95_ms=float(np.percentile(lat, 95)),
+            p99_ms=float(np.percentile(lat, 99)),
+            max_ms=float(lat.max()))
+
+    m = {kind: stats([r for r in records if r[0] == kind]) for kind in sorted({r[0] for r in records})}
+    m['all'] = stats(records)
+    return m
+
+
+def run(
+        server: str = 'flask',
+        concurrency: int = 8,
+        duration: float = 10,
+        warmup: float = 2,
+        mix: dict = None,
+        batch_rows: int = 100,
+        port: int = 8765,
+        p_model: Path = None,
+        env: dict = None) -> dict:
+    """Start server, drive load, return results dict"""
+    mix = mix or dict(single=0.8, empty=0.1, invalid=0.1)
+    model_name = str(p_model) if not p_model is None else 'stand-in'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if p_model is None:
+            p_model = make_model(Path(tmp) / 'model.joblib')
+
+        proc = start_server(server=server, port=port, p_model=p_model, env=env)
+
+        try:
+            # warm up connections/model, then measure
+            for phase, secs in (('warmup', warmup), ('measure', duration)):
+                records = []
+                stop = time.perf_counter() + secs
+                threads = [
+                    threading.Thread(
+                        target=worker,
+                        args=(port, mix, stop, batch_rows, i, records))
+                    for i in range(concurrency)]
+
+                t = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                elapsed = time.perf_counter() - t
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    return dict(
+        config=dict(
+            server=server,
+            concurrency=concurrency,
+            duration=duration,
+            mix=mix,
+            batch_rows=batch_rows,
+            model=model_name,
+            env=env or {}),
+        system=dict(
+            python=platform.python_version(),
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            commit=_git_commit()),
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        elapsed=elapsed,
+        results=summarize(records, secs=elapsed))
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=p_root,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def print_results(m: dict):
+    cols = ['requests', 'rps', 'unexpected_status', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    print(f'{"kind":<8}' + ''.join(f'{c:>18}' for c in cols))
+
+    for kind, stats in m['results'].items():
+        print(f'{kind:<8}' + ''.join(
+            f'{stats[c]:>18,.0f}' if c in ('requests', 'unexpected_status') else f'{stats[c]:>18,.2f}'
+            for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the rainfall prediction service')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='seconds to measure')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of unmeasured load first')
+    parser.add_argument('--mix', type=parse_mix, default='single=0.8,empty=0.1,invalid=0.1')
+    parser.add_argument('--batch-rows', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--model', type=Path, default=None, help='model file, default fit stand-in model')
+    parser.add_argument(
+        '--env', nargs='*', default=[],
+        help='extra server env vars, eg RAINFALL_MAX_BATCH_SIZE=32 RAINFALL_CACHE_SIZE=0')
+    parser.add_argument('--out', type=Path, default=None, help='write json results here')
+    args = parser.parse_args()
+
+    m = run(
+        server=args.server,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        warmup=args.warmup,
+        mix=args.mix,
+        batch_rows=args.batch_rows,
+        port=args.port,
+        p_model=args.model,
+        env=dict(item.split('=', 1) for item in args.env))
+
+    print_results(m)
+
+    if not args.out is None:
+        with open(args.out, 'w') as file:
+            json.dump(m, file, indent=4)
+
+        print(f'Results written to: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Multi-process prediction server sharing one read-only copy of the model
+
+The parent process imports app.py (loading the model once), freezes the garbage collector so
+workers don't write to shared object pages, then forks N workers which all accept connections
+on the same listening socket. Model arrays are shared copy-on-write between workers, or through
+the page cache when the model file is an uncompressed joblib dump loaded with mmap_mode='r'.
+
+Only the parent watches the model file (every RAINFALL_MODEL_POLL seconds). When a new version is
+swapped in, it forks a new set of workers sharing the new model, then stops the old ones once
+their in flight requests finish, so workers never load their own copy of a model.
+
+Linux only (uses fork and /proc for the memory report).
+
+Examples
+--------
+>>> python prefork.py --workers 4 --port 8080
+>>> kill -USR1 <parent pid>  # print memory report
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src import getlog
+
+log = getlog(__name__)
+
+
+def read_memory(pid: int) -> dict:
+    """Return memory stats in mb for process from /proc
+    - rss: resident set size, counts shared pages fully in every process
+    - pss: proportional set size, shared pages split between processes sharing them
+    - shared/private: resident pages shared with other processes or only used by this one
+    """
+    m = dict(pid=pid)
+
+    with open(f'/proc/{pid}/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                m['rss'] = int(line.split()[1]) / 1024
+
+    p_rollup = Path(f'/proc/{pid}/smaps_rollup')
+    if p_rollup.exists():
+        keys = dict(Pss='pss', Shared_Clean='shared', Shared_Dirty='shared', Private_Clean='private', Private_Dirty='private')
+        for k in set(keys.values()):
+            m[k] = 0.0
+
+        with open(p_rollup) as file:
+            for line in file:
+                k = line.split(':')[0]
+                if k in keys:
+                    m[keys[k]] += int(line.split()[1]) / 1024
+
+    return m
+
+
+def memory_report(parent: int, workers: list) -> list:
+    """Print and return memory stats for parent and each worker"""
+    rows = []
+    for pid, role in [(parent, 'parent')] + [(pid, 'worker') for pid in workers]:
+        try:
+            rows.append(dict(read_memory(pid), role=role))
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+
+    cols = ['rss', 'pss', 'shared', 'private']
+    print(f'{"role":<8}{"pid":>8}' + ''.join(f'{c + "_mb":>12}' for c in cols))
+    for row in rows:
+        print(f'{row["role"]:<8}{row["pid"]:>8}' + ''.join(f'{row.get(c, float("nan")):>12.1f}' for c in cols))
+
+    w = [row for row in rows if row['role'] == 'worker']
+    if w and 'pss' in w[0]:
+        total_pss = sum(row['pss'] for row in rows)
+        naive = rows[0]['rss'] * len(rows)
+        print(f'Total PSS: {total_pss:.1f}mb, vs {naive:.1f}mb for {len(rows)} separate copies of parent RSS')
+
+    sys.stdout.flush()
+    return rows
+
+
+class InFlight(object):
+    """WSGI middleware counting requests being handled, so a stopping worker can let them finish"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.n = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.n += 1
+        try:
+            return list(self.wsgi_app(environ, start_response))
+        finally:
+            with self._lock:
+                self.n -= 1
+
+
+def serve_worker(sock: socket.socket, flask_app, grace: float = 10.0):
+    """Run threaded werkzeug server on inherited listening socket, on SIGTERM stop accepting new
+    connections and exit once in flight requests finish (or after grace seconds)
+    """
+    from werkzeug.serving import make_server
+
+    wsgi_app = InFlight(flask_app)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, wsgi_app, threaded=True, fd=sock.fileno())
+
+    # shutdown blocks until serve_forever returns, so can't run in the signal handler's thread
+    def stop(*_args):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    # only parent handles reports/shutdown of workers
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    server.serve_forever()
+
+    deadline = time.time() + grace
+    while wsgi_app.n > 0 and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prefork rainfall prediction server')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--report', type=float, default=0, help='print memory report every n seconds, 0 to disable')
+    args = parser.parse_args()
+
+    # workers forked before signal handlers below are set must not die on report signal
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    # load model once in parent, before fork. Parent polls for new versions itself, watcher thread
+    # must be off before first read of registry.active, or every worker would reload its own copy
+    import app
+    registry = app.registry
+    poll_interval, registry.poll_interval = registry.poll_interval, 0
+
+    model, version = registry.active
+    log.info(f'Loaded model {version} in parent {os.getpid()}')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    workers = {}
+    retiring = set()
+
+    def spawn(i: int):
+        # objects already allocated won't be touched by gc in workers, keeps their pages shared
+        gc.collect()
+        gc.freeze()
+
+        pid = os.fork()
+        if pid == 0:
+            # fork copies parent's rng state, reseed so workers don't all return same random input
+            np.random.seed()
+
+            try:
+                serve_worker(sock=sock, flask_app=app.app)
+            finally:
+                os._exit(0)
+
+        workers[pid] = i
+        log.info(f'Started worker {i} pid {pid}')
+
+    for i in range(args.workers):
+        spawn(i)
+
+    def recycle():
+        """Fork workers sharing newly loaded model, then stop old ones gracefully"""
+        old = list(workers)
+        workers.clear()
+
+        for i in range(args.workers):
+            spawn(i)
+
+        for pid in old:
+            retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def shutdown(*_args):
+        for pid in list(workers) + list(retiring):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGUSR1, lambda *_args: memory_report(os.getpid(), list(workers)))
+
+    log.info(f'Serving on {args.host}:{args.port} with {args.workers} workers')
+    last_report = last_poll = time.time()
+
+    # restart workers that die
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+
+        if pid in retiring:
+            retiring.discard(pid)
+            log.info(f'Old worker pid {pid} stopped')
+
+        elif pid in workers:
+            i = workers.pop(pid)
+            log.warning(f'Worker {i} pid {pid} exited with status {status}, restarting')
+            spawn(i)
+
+        if poll_interval > 0 and time.time() - last_poll > poll_interval:
+            last_poll = time.time()
+            try:
+                if registry.reload():
+                    log.info(f'Recycling workers for model version {registry.version}')
+                    recycle()
+            except Exception as e:
+                log.error(f'Model reload failed: {e}')
+
+        if args.report > 0 and time.time() - last_report > args.report:
+            memory_report(os.getpid(), list(workers))
+            last_report = time.time()
+
+        time.sleep(0.5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Rolling origin (expanding window) backtest of a rainfall model on the daily feature table
+
+At each origin the model is trained on every day before it and predicts the next `horizon` days.
+Instead of refitting from zero at every origin:
+- the model is fully fit every `refit_every` origins, and in between updated with just the days
+    since the previous origin (see incremental.update_model), so most origins cost a fit on
+    `step` days rather than on the full history
+- each full fit starts a segment of origins which doesn't depend on any other, segments are run
+    in parallel, so results are the same for any number of processes
+- models which can't be updated incrementally (anything but lightgbm, see can_update) are refit
+    in full at every origin, each origin is its own segment
+- lightgbm only adds trees when it can split the new days, so `step` must be more than
+    2 * min_child_samples, otherwise every origin is refit in full too. An update which still adds
+    no trees is replaced by a full fit, so origins counted as incremental really were updated
+- predictions from all origins are stacked into (n_origins, horizon) arrays and scored for every
+    horizon at once (see sklearn_helper_funcs.horizon_scores)
+
+Examples
+--------
+>>> from src import backtest
+>>> df = pd.read_parquet('data/output/ml_data_SYD.parquet')
+>>> x, y = sf.split(df, target='observed_rain')
+>>> df_scores, df_pred, df_origins = backtest.rolling_origin(pipe, x, y, horizon=30, n_jobs=-1)
+"""
+
+import time
+from typing import Tuple, Union
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, cpu_count, delayed, effective_n_jobs, parallel_backend
+from lightgbm import LGBMModel
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+
+from . import incremental as inc
+from . import sklearn_helper_funcs as sf
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+
+def make_origins(n: int, initial: Union[int, float]=0.5, horizon: int=30, step: int=None) -> np.ndarray:
+    """Row positions of forecast origins, train on rows [:origin], test on [origin:origin + horizon]
+
+    Parameters
+    ----------
+    n : int
+        rows in series
+    initial : Union[int, float], optional
+        rows before first origin, or fraction of n, by default 0.5
+    horizon : int, optional
+        rows predicted from each origin, by default 30
+    step : int, optional
+        rows between origins, by default horizon (test windows don't overlap)
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if isinstance(initial, float):
+        initial = int(n * initial)
+
+    step = step or horizon
+    origins = np.arange(initial, n - horizon + 1, step)
+
+    if len(origins) < 2:
+        raise ValueError(f'Need at least 2 origins to score, got {len(origins)}: n={n}, initial={initial}, horizon={horizon}, step={step}')
+
+    return origins
+
+
+def rolling_origin(
+        model,
+        x: pd.DataFrame,
+        y,
+        initial: Union[int, float]=0.5,
+        horizon: int=30,
+        step: int=None,
+        n_estimators: int=10,
+        refit_every: int=10,
+        n_jobs: int=None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Backtest model from every origin, refitting incrementally between origins where possible
+
+    Parameters
+    ----------
+    model : Pipeline | estimator
+        unfitted model, cloned for each segment
+    x : pd.DataFrame
+        features in time order, one row per day
+    y : array-like
+    initial : Union[int, float], optional
+        rows before first origin, or fraction of rows, by default 0.5
+    horizon : int, optional
+        days predicted from each origin, by default 30
+    step : int, optional
+        days between origins, by default horizon, must be more than 2 * min_child_samples of
+        lightgbm model for incremental updates
+    n_estimators : int, optional
+        trees added at each incremental update, by default 10
+    refit_every : int, optional
+        refit in full every refit_every origins (counted from first origin), which sets the
+        segments run in parallel, 1 refits at every origin, None only at first origin (no
+        parallelism), by default 10
+    n_jobs : int, optional
+        processes running segments, doesn't change results, by default None (1)
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+        - scores per horizon: smape, mase, avg_mase_smape
+        - predictions: origin, horizon, time, y_true, y_pred
+        - fit per origin: origin, n_train, method (full/incremental), fit_time
+    """
+    y = np.asarray(y).ravel()
+    origins = make_origins(n=len(x), initial=initial, horizon=horizon, step=step)
+
+    # full fit at these global origin positions, each starts a segment
+    if not can_update(model):
+        refit_every = 1
+    else:
+        min_rows = 2 * _min_child_samples(model) + 1
+        step = step or horizon
+
+        if step < min_rows:
+            log.warning(
+                f'step={step} days is too few for lightgbm to add trees (needs {min_rows}, '
+                f'2 * min_child_samples + 1), refitting in full at every origin')
+            refit_every = 1
+
+    starts = np.arange(0, len(origins), refit_every or len(origins))
+    segments = np.split(origins, starts[1:])
+
+    n_workers = max(1, min(effective_n_jobs(n_jobs), len(segments)))
+    n_threads = max(1, cpu_count() // n_workers)
+
+    model = clone(model)
+    _set_n_jobs(model, n_threads)
+
+    log.info(f'Backtesting {len(origins)} origins in {len(segments)} segments with {n_workers} workers')
+
+    t = time.perf_counter()
+    with parallel_backend('loky', inner_max_num_threads=n_threads):
+        results = Parallel(n_jobs=n_workers, max_nbytes='1M', mmap_mode='r')(
+            delayed(run_segment)(model, x, y, origins=seg, horizon=horizon, n_estimators=n_estimators)
+            for seg in segments)
+
+    y_pred = np.concatenate([r[0] for r in results])
+    df_origins = pd.concat([r[1] for r in results], ignore_index=True)
+
+    # (n_origins, horizon) row positions of every prediction
+    idx = origins[:, None] + np.arange(horizon)
+    y_true = y[idx]
+
+    df_scores = sf.horizon_scores(y_true, y_pred)
+
+    df_pred = pd.DataFrame(dict(
+        origin=np.repeat(x.index[origins], horizon),
+        horizon=np.tile(np.arange(1, horizon + 1), len(origins)),
+        time=x.index[idx.ravel()],
+        y_true=y_true.ravel(),
+        y_pred=y_pred.ravel()))
+
+    log.info(
+        f'Backtest done in {time.perf_counter() - t:.1f}s, fit time {df_origins.fit_time.sum():.1f}s, '
+        f'{(df_origins.method == "incremental").sum()}/{len(df_origins)} incremental, '
+        f'mean smape={df_scores.smape.mean():.3f}, mase={df_scores.mase.mean():.3f}')
+
+    return df_scores, df_pred, df_origins
+
+
+def run_segment(
+        model,
+        x: pd.DataFrame,
+        y: np.ndarray,
+        origins: np.ndarray,
+        horizon: int,
+        n_estimators: int=10) -> Tuple[np.ndarray, pd.DataFrame]:
+    """Fit model at first origin of segment, update it with the days between each following origin,
+    predict horizon days from every origin
+
+    Returns
+    -------
+    Tuple[np.ndarray, pd.DataFrame]
+        predictions (n_origins, horizon), fit per origin
+    """
+    fitted = None
+    prev = None
+    preds, rows = [], []
+
+    for origin in origins:
+        full = fitted is None
+
+        t = time.perf_counter()
+        if not full:
+            n_before = inc.n_trees(fitted)
+            fitted = inc.update_model(fitted, x.iloc[prev:origin], y[prev:origin], n_estimators=n_estimators)
+
+            # lightgbm couldn't split new days, don't count unchanged model as incremental fit
+            full = inc.n_trees(fitted) == n_before
+
+        if full:
+            fitted = clone(model).fit(x.iloc[:origin], y[:origin])
+
+        rows.append(dict(
+            origin=x.index[origin],
+            n_train=origin,
+            method='full' if full else 'incremental',
+            fit_time=time.perf_counter() - t))
+
+        preds.append(fitted.predict(x.iloc[origin:origin + horizon]))
+        prev = origin
+
+    return np.vstack(preds), pd.DataFrame(rows)
+
+
+def can_update(model) -> bool:
+    """True if model (fitted or not) is lightgbm, alone or after a single transformer, so
+    incremental.update_model can continue boosting it on the days since the last origin
+
+    Forests and sklearn gradient boosting can add trees with warm_start too, but with their default
+    min leaf size of 1 every update overfits the few new days, and backtest scores got much worse
+    than refitting with every origin, lightgbm's min_child_samples keeps the new trees shallow.
+    """
+    if isinstance(model, Pipeline):
+        if not len(model.steps) == 2:
+            return False
+
+        model = model.steps[-1][1]
+
+    return isinstance(model, LGBMModel)
+
+
+def _min_child_samples(model) -> int:
+    """min_child_samples of lightgbm model, alone or last step of Pipeline"""
+    if isinstance(model, Pipeline):
+        model = model.steps[-1][1]
+
+    return model.get_params()['min_child_samples']
+
+
+def _set_n_jobs(model, n_jobs: int):
+    """Share cpus between processes, instead of each model using all cores"""
+    key = f'{model.steps[-1][0]}__n_jobs' if isinstance(model, Pipeline) else 'n_jobs'
+    if key in model.get_params():
+        model.set_params(**{key: n_jobs})
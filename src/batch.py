@@ -0,0 +1,212 @@
+"""
+Batch feature generation and model training for many locations
+
+One pass over the rainfall dataset builds every location's feature table (see src/features.py),
+then one model per location is trained in a process pool, with the same split/model as
+milestone 3 (`ModelManager.make_train_test`, `LGBMRegressor(max_depth=3, n_estimators=50)`).
+
+Each model is saved as a new version `{p_models}/{name}/model_{timestamp}.joblib` with a matching
+`.json` of metadata (location, feature columns, test scores, params). Pointing the app at a
+location's dir (`RAINFALL_MODEL=models/SYD`) serves the newest version, and hot swaps in the next
+one when it is written.
+
+Examples
+--------
+>>> from src import batch
+>>> results = batch.run_batch(
+...     locations=dict(SYD=(-33.86, 151.21), MEL=(-37.81, 144.96)),
+...     obs_files=dict(MEL='data/csv/observed_daily_rainfall_MEL.csv'))
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+
+from . import features as ft
+from . import sklearn_helper_funcs as sf
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+p_model_dir = Path(os.environ.get('RAINFALL_MODEL_DIR', Path(__file__).parents[1] / 'models'))
+
+target = 'observed_rain'
+
+
+def default_model():
+    """Final model from milestone 3"""
+    from lightgbm import LGBMRegressor
+    return LGBMRegressor(max_depth=3, n_estimators=50)
+
+
+def run_batch(
+        locations: dict,
+        obs_files: dict=None,
+        path: Union[Path, str]=None,
+        p_features: Union[Path, str]=None,
+        p_models: Union[Path, str]=None,
+        model=None,
+        workers: int=None,
+        train_size: float=0.8,
+        random_state: int=123,
+        storage_options: dict=None,
+        **kw) -> pd.DataFrame:
+    """Build feature tables for all locations in one pass, then train and save a model per location
+
+    Parameters
+    ----------
+    locations : dict
+        {name: (lat, lon)}
+    obs_files : dict, optional
+        {name: observed rainfall csv}, by default `data/csv/observed_daily_rainfall_{name}.csv`
+    path : Union[Path, str], optional
+        rainfall dataset path or url, by default data/parquet/rainfall
+    p_features : Union[Path, str], optional
+        dir to write feature tables to, by default data/output
+    p_models : Union[Path, str], optional
+        dir to write `{name}/model_{timestamp}.joblib` to, by default models (or RAINFALL_MODEL_DIR)
+    model : estimator, optional
+        unfitted model, cloned per location, by default LGBMRegressor(max_depth=3, n_estimators=50)
+    workers : int, optional
+        processes for feature scan and training, by default cpu count
+    train_size : float, optional
+        by default 0.8
+    random_state : int, optional
+        train/test split seed, by default 123
+    storage_options : dict, optional
+        credentials/endpoint for remote dataset/observed/feature paths, by default None
+    kw :
+        passed to features.build_features, eg batch_rows
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per location trained, with model path and test scores
+    """
+    p_models = Path(p_models if not p_models is None else p_model_dir)
+    model = model if not model is None else default_model()
+    workers = workers or os.cpu_count() or 1
+
+    t = time.perf_counter()
+    paths = ft.build_features(
+        locations=locations,
+        path=path,
+        obs_files=obs_files,
+        p_dst=p_features,
+        workers=workers,
+        storage_options=storage_options,
+        **kw)
+
+    log.info(f'Built {len(paths)} feature tables in {time.perf_counter() - t:.1f}s')
+
+    tasks = [
+        dict(
+            name=name,
+            point=locations[name],
+            p_features=p,
+            p_dst=p_models / name,
+            model=model,
+            n_jobs=max(1, (os.cpu_count() or 1) // min(workers, len(paths))),
+            train_size=train_size,
+            random_state=random_state,
+            storage_options=storage_options)
+        for name, p in paths.items()]
+
+    t = time.perf_counter()
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(train_location, tasks))
+    else:
+        results = [train_location(task) for task in tasks]
+
+    log.info(f'Trained {len(results)} models in {time.perf_counter() - t:.1f}s')
+
+    return pd.DataFrame(results)
+
+
+def train_location(task: dict) -> dict:
+    """Train one location's model on its feature table and save new model version
+
+    Returns
+    -------
+    dict
+        location, model path and test scores
+    """
+    name = task['name']
+    df = pd.read_parquet(task['p_features'], **ft._storage_kw(task['p_features'], task['storage_options'])) \
+        .dropna() \
+        .pipe(sf.lower_cols)
+
+    mm = sf.ModelManager(random_state=task['random_state'])
+    x_train, y_train, x_test, y_test = mm.make_train_test(df, target=target, train_size=task['train_size'])
+
+    model = clone(task['model'])
+
+    # share cpus between locations training at same time
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=task['n_jobs'])
+
+    t = time.perf_counter()
+    model.fit(x_train, y_train)
+    train_time = time.perf_counter() - t
+
+    y_pred = model.predict(x_test)
+    scores = dict(
+        rmse=float(np.sqrt(np.mean((y_test - y_pred) ** 2))),
+        smape=float(sf.smape(y_test, y_pred)))
+
+    meta = dict(
+        location=name,
+        lat=task['point'][0],
+        lon=task['point'][1],
+        features=list(x_train.columns),
+        target=target,
+        n_train=len(x_train),
+        n_test=len(x_test),
+        train_time=train_time,
+        scores=scores,
+        model=type(model).__name__,
+        params=model.get_params(),
+        source=str(task['p_features']))
+
+    p = save_model(model, p_dst=task['p_dst'], meta=meta)
+    log.info(f'Saved {name} model: {p}, rmse={scores["rmse"]:.3f}, smape={scores["smape"]:.3f}')
+
+    return dict(location=name, path=str(p), n_train=len(x_train), train_time=train_time, **scores)
+
+
+def save_model(model, p_dst: Union[Path, str], meta: dict=None) -> Path:
+    """Save model as new version `model_{timestamp}.joblib` in p_dst, with metadata json
+
+    The joblib file is written under a temp name and renamed into place, so a registry watching
+    p_dst never sees a partial file, and its metadata json exists before it does.
+
+    Returns
+    -------
+    Path
+        saved model path
+    """
+    p_dst = Path(p_dst)
+    p_dst.mkdir(parents=True, exist_ok=True)
+
+    created = datetime.now(timezone.utc)
+    p = p_dst / f'model_{created.strftime("%Y%m%d-%H%M%S-%f")}.joblib'
+
+    meta = dict(meta or {}, version=p.stem, created=created.isoformat())
+    with open(p.with_suffix('.json'), 'w') as file:
+        json.dump(meta, file, indent=4, default=str)
+
+    p_tmp = p.with_name(f'_{p.name}.tmp')
+    joblib.dump(model, p_tmp)
+    p_tmp.replace(p)
+
+    return p
@@ -0,0 +1,123 @@
+"""
+Coalesce concurrent single-row predictions into one batched model.predict call
+
+Examples
+--------
+>>> from src.batcher import PredictionBatcher
+>>> batcher = PredictionBatcher(predict=model.predict, max_batch_size=64, max_wait=0.002)
+>>> batcher.predict(np.arange(25))
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+
+class PredictionBatcher(object):
+    """Collect pending rows from concurrent worker threads and predict them as a single matrix
+    - first row to arrive opens a batch, which is flushed when it reaches max_batch_size
+    or max_wait seconds have passed since it was opened
+    - each caller blocks only until its own batch has been predicted
+    """
+
+    def __init__(self, predict: Callable, max_batch_size: int = 32, max_wait: float = 0.002):
+        """
+        Parameters
+        ----------
+        predict : Callable
+            function taking (n, n_features) array, returning n predictions
+        max_batch_size : int, optional
+            max rows per model.predict call, by default 32
+        max_wait : float, optional
+            max seconds to hold first row of batch waiting for more rows, by default 0.002
+        """
+        if max_batch_size < 1:
+            raise ValueError(f'max_batch_size must be >= 1, got: {max_batch_size}')
+
+        self._predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_batches = 0
+        self.n_rows = 0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        """Rows submitted but not yet collected into a batch"""
+        return self._queue.qsize()
+
+    def predict(self, x: np.ndarray) -> float:
+        """Submit single row and wait for its prediction
+
+        Parameters
+        ----------
+        x : np.ndarray
+            1d array of input values
+
+        Returns
+        -------
+        float
+            model's predicted value for this row
+        """
+        self._ensure_started()
+
+        fut = Future()
+        self._queue.put((x, fut))
+        return fut.result()
+
+    def _ensure_started(self):
+        """Lazily start worker thread (only once, and after any fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='PredictionBatcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        """Block for first row, then gather more until batch full or deadline reached"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # deadline passed, still take anything already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futs = [fut for _, fut in batch]
+
+            try:
+                preds = self._predict(np.vstack([x for x, _ in batch]))
+            except Exception as e:
+                for fut in futs:
+                    fut.set_exception(e)
+                continue
+
+            self.n_batches += 1
+            self.n_rows += len(batch)
+
+            for fut, pred in zip(futs, preds):
+                fut.set_result(pred)
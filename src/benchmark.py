@@ -0,0 +1,339 @@
+"""
+Repeatable version of milestone 1's load strategy comparison for the max rain query
+
+Generates a synthetic combined rainfall dataset (same columns as milestone 1's combined csv:
+time, lat_min, lat_max, lon_min, lon_max, rain, model) of any number of rows, written once as
+csv, feather and parquet, then times each strategy for `max(rain)` in a fresh process and
+records its peak memory, so results don't depend on what ran before.
+
+Strategies
+----------
+- csv_baseline: pd.read_csv, whole file
+- csv_chunks: pd.read_csv in chunks of 1M rows
+- csv_one_col: pd.read_csv(usecols=['rain'])
+- csv_dask: dask.dataframe.read_csv (skipped if dask not installed)
+- feather: rain column only from feather (arrow ipc) file, memory mapped
+- parquet: rain column only from parquet file
+- arrow_dataset: streaming scan of rain column from parquet with pyarrow.dataset
+
+Examples
+--------
+>>> python -m src.benchmark --rows 10_000_000 --repeat 3
+>>> from src import benchmark
+>>> df = benchmark.run(rows=1_000_000)
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+models = [
+    'ACCESS-CM2', 'ACCESS-ESM1-5', 'AWI-ESM-1-1-LR', 'BCC-CSM2-MR', 'BCC-ESM1', 'CanESM5',
+    'CMCC-CM2-HR4', 'CMCC-CM2-SR5', 'CMCC-ESM2', 'EC-Earth3-Veg-LR', 'FGOALS-f3-L', 'FGOALS-g3',
+    'GFDL-CM4', 'INM-CM4-8', 'INM-CM5-0', 'KIOST-ESM', 'MIROC6', 'MPI-ESM-1-2-HAM', 'MPI-ESM1-2-HR',
+    'MPI-ESM1-2-LR', 'MRI-ESM2-0', 'NESM3', 'NorESM2-LM', 'NorESM2-MM', 'SAM0-UNICON', 'TaiESM1']
+
+schema = pa.schema([
+    ('time', pa.timestamp('s')),
+    ('lat_min', pa.float64()),
+    ('lat_max', pa.float64()),
+    ('lon_min', pa.float64()),
+    ('lon_max', pa.float64()),
+    ('rain', pa.float64()),
+    ('model', pa.string())])
+
+formats = ('csv', 'feather', 'parquet')
+
+
+def dataset_paths(p_dir: Union[Path, str], rows: int, seed: int=0) -> dict:
+    """{format: path} of dataset files, named by rows and seed so different sizes can share p_dir"""
+    return {fmt: Path(p_dir) / f'combined_data_{rows}_{seed}.{fmt}' for fmt in formats}
+
+
+def make_batches(rows: int, batch_rows: int=1_000_000, n_cells: int=50, seed: int=0):
+    """Yield record batches of synthetic rainfall rows, ordered by model then day then grid cell"""
+    rng = np.random.default_rng(seed)
+    rows_per_model = -(-rows // len(models))
+
+    # grid of 1 degree cells over nsw
+    lat = -37.0 + np.arange(n_cells) // 10
+    lon = 141.0 + np.arange(n_cells) % 10
+    start = np.datetime64('1889-01-01T12:00:00', 's')
+
+    for i in range(0, rows, batch_rows):
+        idx = np.arange(i, min(i + batch_rows, rows))
+        model_idx = idx // rows_per_model
+        row = idx % rows_per_model
+        cell = row % n_cells
+
+        # ~40% wet days, gamma distributed amounts
+        rain = rng.gamma(0.6, 8.0, len(idx)) * (rng.random(len(idx)) < 0.4)
+        rain[rng.random(len(idx)) < 0.001] = np.nan
+
+        yield pa.record_batch([
+            pa.array(start + (row // n_cells).astype('timedelta64[D]'), type=schema.field('time').type),
+            pa.array(lat[cell], type=pa.float64()),
+            pa.array(lat[cell] + 1.0, type=pa.float64()),
+            pa.array(lon[cell], type=pa.float64()),
+            pa.array(lon[cell] + 1.0, type=pa.float64()),
+            pa.array(rain),
+            pa.array(np.array(models)[model_idx % len(models)])],
+            schema=schema)
+
+
+def make_dataset(p_dir: Union[Path, str], rows: int=1_000_000, seed: int=0) -> dict:
+    """Write same synthetic data as csv, feather and parquet, one batch in memory at a time
+
+    Returns
+    -------
+    dict
+        {format: path}
+    """
+    p_dir = Path(p_dir)
+    p_dir.mkdir(parents=True, exist_ok=True)
+    paths = dataset_paths(p_dir, rows=rows, seed=seed)
+
+    log.info(f'Writing {rows:,.0f} synthetic rows to: {p_dir}')
+
+    # feather v2 is the arrow ipc file format, lz4 is write_feather's default compression
+    with pacsv.CSVWriter(paths['csv'], schema) as w_csv, \
+            pa.ipc.new_file(paths['feather'], schema, options=pa.ipc.IpcWriteOptions(compression='lz4')) as w_feather, \
+            pq.ParquetWriter(paths['parquet'], schema) as w_parquet:
+
+        for batch in make_batches(rows=rows, seed=seed):
+            w_csv.write_batch(batch)
+            w_feather.write_batch(batch)
+            w_parquet.write_batch(batch)
+
+    return paths
+
+
+def csv_baseline(paths: dict) -> float:
+    return pd.read_csv(paths['csv']).rain.max()
+
+
+def csv_chunks(paths: dict) -> float:
+    max_rain = np.finfo('float64').min
+
+    for df_chunk in pd.read_csv(paths['csv'], chunksize=1_000_000):
+        max_rain = max(max_rain, df_chunk.rain.max())
+
+    return max_rain
+
+
+def csv_one_col(paths: dict) -> float:
+    return pd.read_csv(paths['csv'], usecols=['rain']).rain.max()
+
+
+def csv_dask(paths: dict) -> float:
+    import dask.dataframe as dd
+    return dd.read_csv(paths['csv']).rain.max().compute()
+
+
+def _max(arr) -> float:
+    """Max of arrow array, pc.max only exists in pyarrow>=6"""
+    return pc.min_max(arr).as_py()['max']
+
+
+def feather(paths: dict) -> float:
+    import pyarrow.feather as pf
+    return _max(pf.read_table(paths['feather'], columns=['rain'], memory_map=True)['rain'])
+
+
+def parquet(paths: dict) -> float:
+    return _max(pq.read_table(paths['parquet'], columns=['rain'])['rain'])
+
+
+def arrow_dataset(paths: dict) -> float:
+    max_rain = None
+
+    for batch in ds.dataset(paths['parquet'], format='parquet').to_batches(columns=['rain']):
+        cur = _max(batch['rain'])
+        if not cur is None and (max_rain is None or cur > max_rain):
+            max_rain = cur
+
+    return max_rain
+
+
+strategies = dict(
+    csv_baseline=csv_baseline,
+    csv_chunks=csv_chunks,
+    csv_one_col=csv_one_col,
+    csv_dask=csv_dask,
+    feather=feather,
+    parquet=parquet,
+    arrow_dataset=arrow_dataset)
+
+strategy_files = dict(feather='feather', parquet='parquet', arrow_dataset='parquet')
+
+
+def measure(name: str, paths: dict) -> dict:
+    """Run one strategy, return time and memory (run in fresh process for clean peak memory)"""
+    rss_before = _rss_mb()
+    t = time.perf_counter()
+    max_rain = strategies[name](paths)
+    elapsed = time.perf_counter() - t
+    peak = _maxrss_mb()
+
+    return dict(
+        method=name,
+        time_s=elapsed,
+        peak_mb=peak,
+        delta_mb=peak - rss_before,
+        max_rain=float(max_rain))
+
+
+def run(
+        rows: int=1_000_000,
+        p_dir: Union[Path, str]=None,
+        names: list=None,
+        repeat: int=1,
+        keep: bool=False,
+        seed: int=0) -> pd.DataFrame:
+    """Generate dataset and measure each strategy
+
+    Parameters
+    ----------
+    rows : int, optional
+        synthetic rows, milestone 1's combined data was ~62M, by default 1_000_000
+    p_dir : Union[Path, str], optional
+        dir for dataset files, reused if files for same rows and seed exist, by default temp dir
+    names : list, optional
+        strategies to run, by default all
+    repeat : int, optional
+        runs per strategy, each in a new process, best time and max memory reported, by default 1
+    keep : bool, optional
+        keep generated files when using temp dir, by default False
+    seed : int, optional
+        by default 0
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per strategy: time_s, peak_mb (process), delta_mb (above rss after imports),
+        size_mb (file read), max_rain
+    """
+    is_tmp = p_dir is None
+    p_dir = Path(tempfile.mkdtemp(prefix='rainfall_bench_') if is_tmp else p_dir)
+    names = names or list(strategies)
+
+    try:
+        paths = dataset_paths(p_dir, rows=rows, seed=seed)
+        if not all(p.exists() for p in paths.values()):
+            t = time.perf_counter()
+            make_dataset(p_dir=p_dir, rows=rows, seed=seed)
+            log.info(f'Wrote dataset in {time.perf_counter() - t:.1f}s')
+
+        results = []
+        for name in names:
+            if name == 'csv_dask' and not _has_dask():
+                log.warning('dask not installed, skipping csv_dask')
+                continue
+
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                    runs.append(pool.submit(measure, name, paths).result())
+
+            m = min(runs, key=lambda m: m['time_s'])
+            m['peak_mb'] = max(m['peak_mb'] for m in runs)
+            m['delta_mb'] = max(m['delta_mb'] for m in runs)
+            m['size_mb'] = paths[strategy_files.get(name, 'csv')].stat().st_size / 1024 ** 2
+            results.append(m)
+
+            log.info(f'{name}: {m["time_s"]:.2f}s, {m["peak_mb"]:,.0f}mb peak')
+
+    finally:
+        if is_tmp and not keep:
+            shutil.rmtree(p_dir, ignore_errors=True)
+
+    df = pd.DataFrame(results).set_index('method')
+
+    if df.max_rain.nunique() > 1:
+        log.warning(f'Strategies returned different max rain: {df.max_rain.to_dict()}')
+
+    return df
+
+
+def _rss_mb() -> float:
+    """Current resident memory, from /proc on linux, else peak"""
+    return _proc_status('VmRSS') or _maxrss_mb()
+
+
+def _maxrss_mb() -> float:
+    """Peak resident memory of this process
+
+    On linux ru_maxrss is kept across the fork + exec used to spawn workers, so it would report
+    the parent's peak, VmHWM is reset for the new process image.
+    """
+    peak = _proc_status('VmHWM')
+    if not peak is None:
+        return peak
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macos, kb on linux
+    return maxrss / 1024 ** 2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def _proc_status(key: str) -> float:
+    """Value in mb of key from /proc/self/status, None if not available"""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(f'{key}:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+
+    return None
+
+
+def _has_dask() -> bool:
+    try:
+        import dask.dataframe
+        return True
+    except ImportError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark load strategies for max rain query')
+    parser.add_argument('--rows', type=lambda x: int(x.replace('_', '')), default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--strategies', nargs='+', choices=list(strategies), default=None)
+    parser.add_argument('--p-dir', default=None, help='dir for dataset files, reused between runs with same rows')
+    parser.add_argument('--out', default=None, help='save results table to csv')
+    args = parser.parse_args()
+
+    df = run(rows=args.rows, p_dir=args.p_dir, names=args.strategies, repeat=args.repeat)
+
+    print(f'\nmax rain query, {args.rows:,.0f} rows, cpus: {os.cpu_count()}')
+    print(df.to_string(float_format=lambda x: f'{x:,.2f}'))
+
+    if not args.out is None:
+        df.to_csv(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+In-process LRU/TTL cache for model predictions keyed on the input values
+
+Examples
+--------
+>>> from src.cache import PredictionCache
+>>> cache = PredictionCache(maxsize=1024, ttl=300, watch='model.joblib')
+>>> key = cache.make_key([1, 2, 3])
+>>> cache.get(key) is None
+True
+>>> cache.put(key, 31.59)
+"""
+
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+
+class PredictionCache(object):
+    """Bounded LRU cache with per-entry time to live
+    - keys are the float64 bytes of the input values, so [1, 2], [1.0, 2.0] and
+    np.array([1., 2.]) share an entry
+    - whole cache is cleared when the watched file (eg model.joblib) changes on disk
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 300,
+            watch: Union[Path, str] = None,
+            check_interval: float = 1.0):
+        """
+        Parameters
+        ----------
+        maxsize : int, optional
+            max number of cached predictions, by default 1024
+        ttl : float, optional
+            seconds before an entry expires, by default 300
+        watch : Union[Path, str], optional
+            file to watch for changes, eg model file, by default None
+        check_interval : float, optional
+            min seconds between stat calls on watched file, by default 1.0
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.watch = Path(watch) if not watch is None else None
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._mtime = self._stat_watch()
+        self._last_check = time.monotonic()
+
+    @staticmethod
+    def make_key(input_vals: Union[list, np.ndarray]) -> Union[bytes, None]:
+        """Canonical key for list or array of input values
+
+        Returns
+        -------
+        Union[bytes, None]
+            native float64 bytes, or None if values aren't all numbers
+        """
+        if isinstance(input_vals, np.ndarray):
+            if not input_vals.dtype == np.float64:
+                return None
+
+            return input_vals.tobytes()
+
+        try:
+            return struct.pack(f'{len(input_vals)}d', *input_vals)
+        except (TypeError, OverflowError, struct.error):
+            return None
+
+    def get(self, key):
+        """Return cached prediction, or None if missing/expired"""
+        now = time.monotonic()
+        self._check_watch(now=now)
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None or now - item[1] > self.ttl:
+                if not item is None:
+                    del self._data[key]
+
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        """Add prediction to cache, evict least recently used if full"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> dict:
+        """Return dict of cache size and hit/miss counts"""
+        total = self.hits + self.misses
+        return dict(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / total if total else 0.0)
+
+    def _stat_watch(self) -> Union[int, None]:
+        if self.watch is None:
+            return None
+
+        try:
+            return self.watch.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check_watch(self, now: float):
+        """Clear cache if watched file modified since last check"""
+        if self.watch is None or now - self._last_check < self.check_interval:
+            return
+
+        self._last_check = now
+        mtime = self._stat_watch()
+
+        if not mtime == self._mtime:
+            log.info(f'{self.watch.name} changed, clearing prediction cache.')
+            self._mtime = mtime
+            self.clear()
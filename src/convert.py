@@ -0,0 +1,177 @@
+"""
+Convert unzipped per-model rainfall csvs into one partitioned Parquet dataset
+
+Each csv is streamed through pyarrow's incremental csv reader, so peak memory is set by
+batch_rows, not by the size of the data. Output is hive partitioned by model
+(`model=ACCESS-CM2/ACCESS-CM2_daily_rainfall_NSW.parquet`), with the model name taken from
+the csv filename and `rain (mm/day)` renamed to `rain`.
+
+Buffered rows are sorted by grid cell before writing, and each cell gets its own row group, so
+readers filtering on lat/lon (see src/loader.py) can skip every row group outside the location
+using parquet statistics alone.
+
+Examples
+--------
+>>> from src import download as dl
+>>> from src import convert
+>>> dl.download_unzip('data.zip', p_dst='csv')
+>>> p = convert.csv_to_parquet(p_csv=dl.p_data / 'csv')
+>>> pd.read_parquet(p)
+"""
+
+import zipfile
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+p_data = Path(__file__).parents[1] / 'data'
+
+cell_cols = ['lat_min', 'lat_max', 'lon_min', 'lon_max']
+
+# schema of raw csvs, and of rows written to parquet (model comes from partition dir)
+csv_types = {
+    'time': pa.timestamp('ms'),
+    **{col: pa.float64() for col in cell_cols},
+    'rain (mm/day)': pa.float64()}
+
+schema = pa.schema([('time', pa.timestamp('ms'))] + [(col, pa.float64()) for col in cell_cols + ['rain']])
+
+
+def model_name(name: str) -> str:
+    """Model name from csv filename, eg 'ACCESS-CM2_daily_rainfall_NSW.csv' -> 'ACCESS-CM2'"""
+    return Path(name).name.split('_')[0]
+
+
+def csv_to_parquet(
+        p_csv: Union[Path, str]=None,
+        p_dst: Union[Path, str]=None,
+        batch_rows: int=1_000_000,
+        block_size: int=1,
+        compression: str='snappy',
+        overwrite: bool=False) -> Path:
+    """Stream all csvs in dir (or zip) into partitioned parquet dataset
+
+    Parameters
+    ----------
+    p_csv : Union[Path, str], optional
+        dir of unzipped csvs, or zip file to read csvs from without unzipping, by default data/csv
+    p_dst : Union[Path, str], optional
+        dataset dir to write, by default data/parquet/rainfall
+    batch_rows : int, optional
+        rows buffered, sorted by grid cell and written per model at a time, by default 1_000_000
+    block_size : int, optional
+        mb of csv text parsed per block, by default 1
+    compression : str, optional
+        parquet compression codec, by default 'snappy'
+    overwrite : bool, optional
+        rewrite models already converted, by default False (skip them)
+
+    Returns
+    -------
+    Path
+        dataset dir
+    """
+    p_csv = Path(p_csv) if not p_csv is None else p_data / 'csv'
+    p_dst = Path(p_dst) if not p_dst is None else p_data / 'parquet' / 'rainfall'
+
+    if p_csv.suffix == '.zip':
+        zf = zipfile.ZipFile(p_csv)
+        names = sorted(name for name in zf.namelist() if name.endswith('.csv'))
+        open_file = zf.open
+    else:
+        zf = None
+        names = sorted(str(p) for p in p_csv.glob('*.csv'))
+        open_file = lambda name: open(name, 'rb')
+
+    log.info(f'Converting {len(names)} csvs to parquet dataset: {p_dst}')
+    n_rows = 0
+
+    try:
+        for name in tqdm(names):
+            model = model_name(name)
+            p = p_dst / f'model={model}' / f'{Path(name).stem}.parquet'
+
+            if p.exists() and not overwrite:
+                log.info(f'Already converted: {p.name}')
+                continue
+
+            with open_file(name) as file:
+                n = _convert_file(
+                    file=file,
+                    p=p,
+                    batch_rows=batch_rows,
+                    block_size=block_size * 1024 * 1024,
+                    compression=compression)
+
+            if n is None:
+                log.warning(f'Skipping {Path(name).name}, missing columns: {list(csv_types)}')
+            else:
+                n_rows += n
+    finally:
+        if not zf is None:
+            zf.close()
+
+    log.info(f'Wrote {n_rows:,.0f} rows to: {p_dst}')
+    return p_dst
+
+
+def _convert_file(file, p: Path, batch_rows: int, block_size: int, compression: str) -> int:
+    """Write one csv to parquet file p, return rows written or None if csv has wrong columns"""
+    try:
+        reader = pacsv.open_csv(
+            file,
+            read_options=pacsv.ReadOptions(block_size=block_size),
+            convert_options=pacsv.ConvertOptions(
+                column_types=csv_types,
+                include_columns=list(csv_types)))
+    except (pa.ArrowInvalid, KeyError):
+        return None
+
+    # write to temp name, ignored by dataset readers ('_' prefix) until complete
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p_tmp = p.with_name(f'_{p.name}.tmp')
+
+    buffer, n_buffered, n_rows = [], 0, 0
+
+    with pq.ParquetWriter(p_tmp, schema=schema, compression=compression) as writer:
+        for batch in reader:
+            buffer.append(batch)
+            n_buffered += batch.num_rows
+
+            if n_buffered >= batch_rows:
+                n_rows += _write_cells(writer, buffer)
+                buffer, n_buffered = [], 0
+
+        if buffer:
+            n_rows += _write_cells(writer, buffer)
+
+    p_tmp.replace(p)
+    return n_rows
+
+
+def _write_cells(writer: pq.ParquetWriter, batches: list) -> int:
+    """Sort buffered batches by grid cell then time, write one row group per cell"""
+    table = pa.Table.from_batches(batches).rename_columns(schema.names)
+
+    # Table.sort_by needs pyarrow>=7, lexsort sorts by last key first
+    keys = [table[col].to_numpy() for col in cell_cols + ['time']]
+    table = table.take(pa.array(np.lexsort(keys[::-1])))
+
+    # row positions where grid cell changes
+    cells = np.column_stack([table[col].to_numpy() for col in cell_cols])
+    starts = np.flatnonzero(np.r_[True, (cells[1:] != cells[:-1]).any(axis=1)])
+    ends = np.r_[starts[1:], len(cells)]
+
+    for start, end in zip(starts, ends):
+        writer.write_table(table.slice(start, end - start), row_group_size=end - start)
+
+    return table.num_rows
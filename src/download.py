@@ -1,19 +1,40 @@
 """
 Download files from figshare
 
+Files are fetched as parallel HTTP Range requests over a shared connection pool when the server
+supports it. Progress is kept in a `.part` file plus a `.part.json` sidecar listing finished
+ranges, so an interrupted download resumes where it stopped instead of starting over.
+
+Files from figshare articles are stored once in a content addressed cache (`{file id}-{md5}`,
+verified while streaming) and linked into the data dir, so matching files are never re-downloaded.
+
+Zip archives can also be extracted straight from the download url with `download_unzip`, each
+member read through its own range requests, so extraction runs while the rest of the archive is
+still downloading and the zip itself never touches disk.
+
 Examples
 --------
 >>> from src import download as dl
 >>> files = dl.download_files('data.zip', chunk_size=10)
 >>> dl.unzip(p=files[0], p_dst='csv', delete=False)
+>>> dl.download_unzip('data.zip', p_dst='csv', workers=8)
 """
 
+import hashlib
+import json
+import os
+import re
 import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Union
 
 import requests
 from nicenumber import nicenumber as nn
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 from .__init__ import getlog
@@ -23,8 +44,55 @@ log = getlog(__name__)
 # set data dir for downloads
 p_data = Path(__file__).parents[1] / 'data'
 
-def download_file(url: str, name: str, chunk_size: int=1):
-    """Download single file in chunks
+# verified downloads, shared between runs, keep on same filesystem as p_data so files can be hardlinked
+p_cache = Path(os.environ.get('RAINFALL_DOWNLOAD_CACHE', p_data / '.cache'))
+
+_session, _pool_size = None, 0
+_session_lock = threading.Lock()
+
+class ChecksumError(Exception):
+    """Downloaded file doesn't match expected md5"""
+    pass
+
+def get_session(pool_size: int=16) -> requests.Session:
+    """Shared requests session, reuses connections across ranges, files and threads
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        max connections kept open per host, pool is only ever grown, by default 16
+
+    Returns
+    -------
+    requests.Session
+    """
+    global _session, _pool_size
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+
+        if pool_size > _pool_size:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _pool_size = pool_size
+
+    return _session
+
+def download_file(
+        url: str,
+        name: str,
+        chunk_size: int=1,
+        workers: int=4,
+        part_size: int=16,
+        retries: int=5,
+        backoff: float=0.5,
+        overwrite: bool=None,
+        progress_bar: tqdm=None,
+        md5: str=None,
+        file_id: Union[int, str]=None):
+    """Download single file in parallel byte ranges, resuming from previous partial download
 
     Parameters
     ----------
@@ -33,44 +101,416 @@ def download_file(url: str, name: str, chunk_size: int=1):
     name : str
         filename to save
     chunk_size : int, optional
-        chunk size in mb to download, by default 1mb
-    """    
+        chunk size in mb to read from each response, by default 1mb
+    workers : int, optional
+        max ranges downloaded at the same time, by default 4
+    part_size : int, optional
+        size in mb of each range request, by default 16mb
+    retries : int, optional
+        attempts per range before giving up, by default 5
+    backoff : float, optional
+        seconds to wait before first retry, doubled each attempt, by default 0.5
+    overwrite : bool, optional
+        overwrite existing file without asking (True) or skip it (False), by default None (ask)
+    progress_bar : tqdm, optional
+        shared progress bar to update instead of creating one, by default None
+    md5 : str, optional
+        expected md5, verify download and store in download cache, by default None
+    file_id : Union[int, str], optional
+        figshare file id, cache key along with md5, by default None
+
+    Returns
+    -------
+    Path
+        downloaded file, or None if existing file not overwritten
+
+    Raises
+    ------
+    ChecksumError
+        downloaded file doesn't match md5
+    """
     p = p_data / name
     chunk_size = chunk_size * 1024 * 1024 # convert to bytes
+    part_size = part_size * 1024 * 1024
 
     if not p_data.exists():
         p_data.mkdir(parents=True)
 
+    p_blob = cache_path(md5=md5, file_id=file_id) if md5 else None
+
+    # already linked/copied from verified cache file, skip without asking
+    if not p_blob is None and is_cached(p, p_blob):
+        log.info(f'{p.name} matches cached md5 {md5}, skipping download.')
+        return p
+
     # ask if okay to overwrite
     if p.exists():
-        ans = _input(msg=f'Data file {p.name} already exists, overwrite?')
+        ans = _input(msg=f'Data file {p.name} already exists, overwrite?') if overwrite is None else overwrite
         if not ans:
             log.info('User declined to overwrite.')
             return
         else:
             log.info('Overwriting data.')
 
-    resp = requests.get(url, stream=True, allow_redirects=True)
-    size_bytes = int(resp.headers.get('content-length', 0))
+    if p_blob is None:
+        _download(
+            url=url,
+            p=p,
+            chunk_size=chunk_size,
+            workers=workers,
+            part_size=part_size,
+            retries=retries,
+            backoff=backoff,
+            progress_bar=progress_bar)
 
-    size_human = nn.to_human(size_bytes, family='filesize')
-    size_human_chunk = nn.to_human(chunk_size, family='filesize')
-    log.info(f'Downloading {size_human} file in {size_human_chunk} chunks.')
+        log.info(f'File downloaded to: {p}')
+        return p
 
-    progress_bar = tqdm(total=size_bytes, unit='iB', unit_scale=True)
+    if p_blob.exists():
+        log.info(f'Using cached {p_blob.name}, no download needed.')
+    else:
+        p_cache.mkdir(parents=True, exist_ok=True)
+        _download(
+            url=url,
+            p=p_blob,
+            chunk_size=chunk_size,
+            workers=workers,
+            part_size=part_size,
+            retries=retries,
+            backoff=backoff,
+            progress_bar=progress_bar,
+            md5=md5)
 
-    with open(p, 'wb') as file:
-        for data in resp.iter_content(chunk_size=chunk_size):
-            progress_bar.update(len(data))
-            if data:
-                file.write(data)
-    
-    progress_bar.close()
+        # cached files are shared by every link, don't let them be edited in place
+        p_blob.chmod(0o444)
+
+    _link(p_blob, p)
     log.info(f'File downloaded to: {p}')
 
     return p
 
-def download_files(dl_files: Union[list, str]=None, article_id: str='14096681', **kw):
+def cache_path(md5: str, file_id: Union[int, str]=None) -> Path:
+    """Path of verified file in download cache"""
+    return p_cache / (f'{file_id}-{md5}' if not file_id is None else md5)
+
+def is_cached(p: Path, p_blob: Path) -> bool:
+    """Check if p is hardlink or unmodified copy (same size and mtime) of cached file"""
+    if not (p.exists() and p_blob.exists()):
+        return False
+
+    if os.path.samefile(p, p_blob):
+        return True
+
+    stat, stat_blob = p.stat(), p_blob.stat()
+    return stat.st_size == stat_blob.st_size and stat.st_mtime_ns == stat_blob.st_mtime_ns
+
+def _link(p_src: Path, p_dst: Path):
+    """Hardlink p_src to p_dst, or copy with same mtime if hardlinks not possible"""
+    p_tmp = p_dst.with_name(f'{p_dst.name}.tmp')
+    if p_tmp.exists():
+        p_tmp.unlink()
+
+    try:
+        os.link(p_src, p_tmp)
+    except OSError:
+        shutil.copy2(p_src, p_tmp)
+
+    p_tmp.replace(p_dst)
+
+def _download(
+        url: str,
+        p: Path,
+        chunk_size: int,
+        workers: int,
+        part_size: int,
+        retries: int,
+        backoff: float,
+        progress_bar: tqdm=None,
+        md5: str=None):
+    """Download url to p through p.part, in parallel ranges if server supports them"""
+    p_part = p.with_name(f'{p.name}.part')
+    p_state = p.with_name(f'{p.name}.part.json')
+
+    # first byte request tells us final url (after redirects), size, and if ranges are supported
+    resp = _retry(
+        lambda: _get(url, headers={'Range': 'bytes=0-0'}, stream=True),
+        retries=retries,
+        backoff=backoff)
+
+    size_bytes = _total_size(resp)
+    size_human = nn.to_human(size_bytes, family='filesize')
+    hasher = hashlib.md5() if md5 else None
+
+    if resp.status_code == 206:
+        resp.close()
+        state = dict(
+            url=url,
+            size=size_bytes,
+            etag=resp.headers.get('etag', ''),
+            part_size=part_size,
+            done=[])
+
+        size_human_part = nn.to_human(part_size, family='filesize')
+        log.info(f'Downloading {size_human} file in {size_human_part} ranges with {workers} workers.')
+
+        _download_ranges(
+            url=resp.url,
+            p_part=p_part,
+            p_state=p_state,
+            state=state,
+            chunk_size=chunk_size,
+            workers=workers,
+            retries=retries,
+            backoff=backoff,
+            progress_bar=progress_bar,
+            hasher=hasher)
+    else:
+        # server ignored range header, stream whole file once (can't resume)
+        size_human_chunk = nn.to_human(chunk_size, family='filesize')
+        log.info(f'Downloading {size_human} file in {size_human_chunk} chunks (no range support).')
+
+        own_bar = progress_bar is None
+        if own_bar:
+            progress_bar = tqdm(total=size_bytes, unit='iB', unit_scale=True)
+
+        written = 0
+
+        try:
+            with open(p_part, 'wb') as file:
+                for data in resp.iter_content(chunk_size=chunk_size):
+                    progress_bar.update(len(data))
+                    written += len(data)
+                    if data:
+                        file.write(data)
+
+                        if not hasher is None:
+                            hasher.update(data)
+        except Exception:
+            progress_bar.update(-written)
+            raise
+        finally:
+            resp.close()
+            if own_bar:
+                progress_bar.close()
+
+    if not hasher is None and not hasher.hexdigest() == md5:
+        # bad content, don't resume from it
+        p_part.unlink()
+        if p_state.exists():
+            p_state.unlink()
+
+        raise ChecksumError(f'{p.name} md5 {hasher.hexdigest()} does not match expected {md5}')
+
+    p_part.replace(p)
+
+    if p_state.exists():
+        p_state.unlink()
+
+def _download_ranges(
+        url: str,
+        p_part: Path,
+        p_state: Path,
+        state: dict,
+        chunk_size: int,
+        workers: int,
+        retries: int,
+        backoff: float,
+        progress_bar: tqdm=None,
+        hasher=None):
+    """Download all ranges not already finished in previous run's sidecar state into p_part
+
+    If hasher given, ranges are fed to it in file order as they arrive. At most 2 * workers ranges
+    are in flight or waiting for an earlier range, which bounds memory held for hashing. Ranges
+    finished in a previous run are read back from p_part, hash state can't be saved between runs.
+    """
+    size, part_size = state['size'], state['part_size']
+
+    # resume only if same remote file and partial file still complete size
+    prev = _load_state(p_state)
+    keys = ('url', 'size', 'etag', 'part_size')
+    if prev and all(prev.get(k) == state[k] for k in keys) and p_part.exists() \
+            and p_part.stat().st_size == size:
+        state['done'] = prev['done']
+        log.info(f'Resuming download, {len(state["done"])} ranges already finished.')
+    else:
+        with open(p_part, 'wb') as file:
+            file.truncate(size)
+
+        _save_state(p_state, state)
+
+    ranges = [(i, start, min(start + part_size, size) - 1) for i, start in enumerate(range(0, size, part_size))]
+    done = set(state['done'])
+    todo = iter([r for r in ranges if not r[0] in done])
+    done_bytes = sum(end - start + 1 for i, start, end in ranges if i in done)
+
+    own_bar = progress_bar is None
+    if own_bar:
+        progress_bar = tqdm(total=size, initial=done_bytes, unit='iB', unit_scale=True)
+    else:
+        progress_bar.update(done_bytes)
+
+    keep = not hasher is None
+
+    def fetch(i: int, start: int, end: int) -> tuple:
+        data = _retry(
+            lambda: _fetch_range(url, p_part, start, end, chunk_size, progress_bar, keep=keep),
+            retries=retries,
+            backoff=backoff)
+
+        return i, data
+
+    # ranges received but not hashed yet, and next range to hash
+    received, i_hash = {}, 0
+    max_ahead = 2 * max(workers, 1) if keep else len(ranges)
+
+    pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='download')
+    futures = set()
+
+    try:
+        while True:
+            # hash all contiguous ranges from start of file available so far, before checking if
+            # anything is left to fetch, so ranges finished in previous run (or last ones received)
+            # are still hashed when no more futures are submitted
+            while keep and i_hash < len(ranges) and (i_hash in received or i_hash in done):
+                if i_hash in received:
+                    hasher.update(received.pop(i_hash))
+                else:
+                    _, start, end = ranges[i_hash]
+                    with open(p_part, 'rb') as file:
+                        file.seek(start)
+                        hasher.update(file.read(end - start + 1))
+
+                i_hash += 1
+
+            while len(futures) + len(received) < max_ahead:
+                r = next(todo, None)
+                if r is None:
+                    break
+
+                futures.add(pool.submit(fetch, *r))
+
+            if not futures:
+                break
+
+            finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i, data = future.result()
+                state['done'].append(i)
+
+                if keep:
+                    received[i] = data
+
+            _save_state(p_state, state)
+    finally:
+        # stop queued ranges on error/interrupt, finished ones stay recorded for resume
+        pool.shutdown(wait=True, cancel_futures=True)
+        if own_bar:
+            progress_bar.close()
+
+def _fetch_range(
+        url: str,
+        p: Path,
+        start: int,
+        end: int,
+        chunk_size: int,
+        progress_bar: tqdm,
+        keep: bool=False) -> bytes:
+    """Download bytes start-end (inclusive) of url into same position of file p
+
+    Returns
+    -------
+    bytes
+        range content if keep, else None
+    """
+    written = 0
+    chunks = []
+
+    try:
+        with _get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True) as resp:
+            if not resp.status_code == 206 or not _range_start(resp) == start:
+                raise requests.HTTPError(f'Expected partial content from byte {start}, got {resp.status_code}')
+
+            with open(p, 'r+b') as file:
+                file.seek(start)
+
+                for data in resp.iter_content(chunk_size=chunk_size):
+                    file.write(data)
+                    written += len(data)
+                    progress_bar.update(len(data))
+
+                    if keep:
+                        chunks.append(data)
+
+                # range is only recorded as done once it's safely on disk
+                file.flush()
+                os.fsync(file.fileno())
+
+        if not written == end - start + 1:
+            raise requests.exceptions.ChunkedEncodingError(
+                f'Range {start}-{end} incomplete, got {written} of {end - start + 1} bytes')
+    except Exception:
+        progress_bar.update(-written)
+        raise
+
+    return b''.join(chunks) if keep else None
+
+def _get(url: str, **kw) -> requests.Response:
+    resp = get_session().get(url, allow_redirects=True, timeout=(10, 60), **kw)
+    resp.raise_for_status()
+    return resp
+
+def _retry(func, retries: int=5, backoff: float=0.5):
+    """Call func, retrying connection/server errors with exponential backoff"""
+    for attempt in range(retries):
+        try:
+            return func()
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                requests.HTTPError) as e:
+            # client errors other than rate limiting won't fix themselves
+            status = getattr(e.response, 'status_code', None)
+            if not status is None and 400 <= status < 500 and not status in (408, 429):
+                raise
+
+            if attempt == retries - 1:
+                raise
+
+            wait = backoff * 2 ** attempt
+            log.warning(f'Download failed ({e}), retrying in {wait:.1f}s.')
+            time.sleep(wait)
+
+def _total_size(resp: requests.Response) -> int:
+    """File size from content-range of partial response, else content-length"""
+    m = re.match(r'bytes \d+-\d+/(\d+)', resp.headers.get('content-range', ''))
+    if m:
+        return int(m.group(1))
+
+    return int(resp.headers.get('content-length', 0))
+
+def _range_start(resp: requests.Response) -> int:
+    m = re.match(r'bytes (\d+)-', resp.headers.get('content-range', ''))
+    return int(m.group(1)) if m else -1
+
+def _load_state(p: Path) -> dict:
+    try:
+        with open(p) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _save_state(p: Path, state: dict):
+    """Write sidecar atomically so an interrupt never leaves it half written"""
+    p_tmp = p.with_name(f'{p.name}.tmp')
+    with open(p_tmp, 'w') as file:
+        json.dump(state, file)
+
+    p_tmp.replace(p)
+
+def download_files(
+        dl_files: Union[list, str]=None,
+        article_id: str='14096681',
+        concurrency: int=1,
+        cache: bool=True,
+        **kw):
     """Download list of files
 
     Parameters
@@ -79,11 +519,95 @@ def download_files(dl_files: Union[list, str]=None, article_id: str='14096681',
         files to download, by default None
     article_id : str, optional
         default '14096681'
+    concurrency : int, optional
+        max files downloaded at the same time, by default 1 (one after another)
+    cache : bool, optional
+        verify files against figshare md5 and reuse matching files from download cache, by default True
+    **kw :
+        passed to download_file, eg chunk_size, workers
+
+    Returns
+    -------
+    list
+        paths of downloaded files, in figshare article order
+    """
+    m_info = article_files(dl_files=dl_files, article_id=article_id)
+
+    for m in m_info:
+        m['kw'] = dict(
+            url=m['download_url'],
+            name=m['name'],
+            md5=m.get('computed_md5') if cache else None,
+            file_id=m.get('id'))
+
+    if concurrency <= 1:
+        files = []
+        for m in m_info:
+            p = download_file(**m['kw'], **kw)
+
+            if p:
+                files.append(p)
+
+        return files
+
+    # ask all overwrite questions up front, prompts can't interleave with running downloads
+    # files matching cache are never asked about
+    overwrite = kw.pop('overwrite', None)
+    for m in m_info:
+        p, md5 = p_data / m['name'], m['kw']['md5']
+        p_blob = cache_path(md5=md5, file_id=m['kw']['file_id']) if md5 else None
+        m['cached'] = not p_blob is None and p_blob.exists()
+        m['match'] = m['cached'] and is_cached(p, p_blob)
+
+        m['overwrite'] = overwrite
+        if overwrite is None and p.exists() and not m['match']:
+            m['overwrite'] = _input(msg=f'Data file {m["name"]} already exists, overwrite?')
+
+    skip = [m for m in m_info if m['overwrite'] is False and (p_data / m['name']).exists() and not m['match']]
+    for m in skip:
+        log.info(f'Not overwriting: {m["name"]}')
+        m_info.remove(m)
+
+    # files already in cache are linked without downloading
+    size_bytes = sum(m.get('size', 0) for m in m_info if not m['cached'])
+    size_human = nn.to_human(size_bytes, family='filesize')
+    log.info(f'Downloading {len(m_info)} files ({size_human}), {concurrency} at a time.')
+
+    progress_bar = tqdm(total=size_bytes, unit='iB', unit_scale=True)
+
+    # files * ranges per file connections can be open at once
+    get_session(pool_size=max(16, concurrency * kw.get('workers', 4)))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='download_files') as pool:
+        futures = [
+            pool.submit(
+                download_file,
+                **m['kw'],
+                overwrite=m['overwrite'],
+                progress_bar=progress_bar,
+                **kw)
+            for m in m_info]
+
+        try:
+            files = [future.result() for future in futures]
+        finally:
+            progress_bar.close()
+
+    return [p for p in files if p]
+
+def article_files(dl_files: Union[list, str]=None, article_id: str='14096681') -> list:
+    """Figshare file info (id, name, size, computed_md5, download_url) for files matching dl_files
+
+    Parameters
+    ----------
+    dl_files : Union[list, str], optional
+        files to match, by default None
+    article_id : str, optional
+        default '14096681'
 
     Returns
     -------
-    requests.respons
-        json response obj
+    list
     """
     if dl_files is None:
         dl_files = ['environment.yml']
@@ -92,21 +616,12 @@ def download_files(dl_files: Union[list, str]=None, article_id: str='14096681',
     
     url = f'https://api.figshare.com/v2/articles/{article_id}'
 
-    resp = requests.get(url).json()
+    resp = get_session().get(url).json()
     
     # filter list of files to download
-    m_info = list(filter(lambda x: [name for name in dl_files if name in x['name']], resp['files']))
-
-    files = []
-    for m in m_info:
-        p = download_file(url=m['download_url'], name=m['name'], **kw)
+    return list(filter(lambda x: [name for name in dl_files if name in x['name']], resp['files']))
 
-        if p:
-            files.append(p)
-
-    return files
-
-def unzip(p: Path, p_dst: Union[Path, str]=None, delete=False) -> Path:
+def unzip(p: Path, p_dst: Union[Path, str]=None, delete=False, workers: int=1) -> Path:
     """Simple wrapper for shultil unpack_archive with default unzip dir
 
     Parameters
@@ -117,6 +632,8 @@ def unzip(p: Path, p_dst: Union[Path, str]=None, delete=False) -> Path:
         Unzip in different dir, by default parent dir
     delete : bool, optional
         Delete original zip after unpack, by default False
+    workers : int, optional
+        extract zip members in parallel threads if > 1, by default 1
     """
     if p_dst is None:
         p_dst = p.parent
@@ -124,13 +641,279 @@ def unzip(p: Path, p_dst: Union[Path, str]=None, delete=False) -> Path:
         p_dst = p.parent / p_dst
 
     log.info(f'Unpacking zip to: {p_dst}')
-    shutil.unpack_archive(p, p_dst)
+
+    if workers > 1 and zipfile.is_zipfile(p):
+        extract_members(open_zip=lambda: zipfile.ZipFile(p), p_dst=p_dst, workers=workers)
+    else:
+        shutil.unpack_archive(p, p_dst)
 
     if delete:
         p.unlink()
 
     return p
 
+def download_unzip(
+        dl_files: Union[list, str]='data.zip',
+        p_dst: Union[Path, str]=None,
+        article_id: str='14096681',
+        keep_zip: bool=False,
+        workers: int=4,
+        **kw) -> Path:
+    """Download and extract zip files from figshare article
+
+    Parameters
+    ----------
+    dl_files : Union[list, str], optional
+        zip files to download, by default 'data.zip'
+    p_dst : Union[Path, str], optional
+        dir to extract to, relative to data dir if str, by default data dir
+    article_id : str, optional
+        default '14096681'
+    keep_zip : bool, optional
+        download (and cache) zip first then extract it in parallel, by default False, extract
+        members straight from url while downloading, zip is never saved
+    workers : int, optional
+        members extracted at the same time, by default 4
+    **kw :
+        passed to download_files if keep_zip, else buffer_size/retries/backoff for unzip_url
+
+    Returns
+    -------
+    Path
+        dir files extracted to
+    """
+    if p_dst is None:
+        p_dst = p_data
+    elif isinstance(p_dst, str):
+        p_dst = p_data / p_dst
+
+    if keep_zip:
+        for p in download_files(dl_files=dl_files, article_id=article_id, **kw):
+            unzip(p=p, p_dst=p_dst, workers=workers)
+
+        return p_dst
+
+    for m in article_files(dl_files=dl_files, article_id=article_id):
+        unzip_url(url=m['download_url'], p_dst=p_dst, workers=workers, **kw)
+
+    return p_dst
+
+def unzip_url(
+        url: str,
+        p_dst: Path,
+        workers: int=4,
+        buffer_size: int=8,
+        retries: int=5,
+        backoff: float=0.5) -> list:
+    """Extract remote zip without downloading whole archive first
+
+    Central directory is read from the end of the file, then members are extracted in parallel,
+    each thread reading its member's bytes through sequential range requests. Member crc32 is
+    checked by zipfile as data is decompressed. Falls back to download + unzip if the server
+    doesn't support range requests.
+
+    Parameters
+    ----------
+    url : str
+        zip download url
+    p_dst : Path
+        dir to extract to
+    workers : int, optional
+        members extracted at the same time, by default 4
+    buffer_size : int, optional
+        mb read ahead per range request, by default 8mb
+    retries : int, optional
+        attempts per range before giving up, by default 5
+    backoff : float, optional
+        seconds to wait before first retry, doubled each attempt, by default 0.5
+
+    Returns
+    -------
+    list
+        extracted file paths
+    """
+    resp = _retry(
+        lambda: _get(url, headers={'Range': 'bytes=0-0'}, stream=True),
+        retries=retries,
+        backoff=backoff)
+    resp.close()
+
+    if not resp.status_code == 206:
+        log.warning('Server does not support range requests, downloading zip before extracting.')
+        p = download_file(url=url, name=Path(resp.url.split('?')[0]).name, overwrite=True)
+        with zipfile.ZipFile(p) as zf:
+            names = [m.filename for m in zf.infolist() if not m.is_dir()]
+
+        unzip(p=p, p_dst=p_dst, delete=True, workers=workers)
+        return [p_dst / name for name in names]
+
+    size = _total_size(resp)
+    size_human = nn.to_human(size, family='filesize')
+    log.info(f'Extracting {size_human} zip from url to: {p_dst}, {workers} members at a time.')
+
+    def open_zip():
+        return zipfile.ZipFile(RangeFile(
+            url=resp.url,
+            size=size,
+            buffer_size=buffer_size * 1024 * 1024,
+            retries=retries,
+            backoff=backoff))
+
+    return extract_members(open_zip=open_zip, p_dst=p_dst, workers=workers)
+
+def extract_members(open_zip, p_dst: Path, workers: int=4) -> list:
+    """Extract all members of zip in parallel threads, largest first
+
+    Parameters
+    ----------
+    open_zip : callable
+        returns new zipfile.ZipFile, each thread reads through its own file handle
+    p_dst : Path
+        dir to extract to
+    workers : int, optional
+        members extracted at the same time, by default 4
+
+    Returns
+    -------
+    list
+        extracted file paths
+    """
+    zf = open_zip()
+    members = sorted(zf.infolist(), key=lambda m: m.compress_size, reverse=True)
+    _close_zip(zf)
+
+    p_dst.mkdir(parents=True, exist_ok=True)
+
+    local = threading.local()
+    handles = []
+    lock = threading.Lock()
+    progress_bar = tqdm(total=sum(m.compress_size for m in members), unit='iB', unit_scale=True)
+
+    def extract(member: zipfile.ZipInfo) -> Path:
+        if not hasattr(local, 'zf'):
+            local.zf = open_zip()
+            with lock:
+                handles.append(local.zf)
+
+        if isinstance(local.zf.fp, RangeFile):
+            # local header is 30 bytes + name + extra field, which can differ from central dir's
+            n_header = 30 + len(member.orig_filename.encode()) + len(member.extra) + 1024
+            local.zf.fp.limit = member.header_offset + n_header + member.compress_size
+
+        try:
+            p = Path(local.zf.extract(member, p_dst))
+        except FileExistsError:
+            # another thread made same sub dir between zipfile's exists check and makedirs
+            p = Path(local.zf.extract(member, p_dst))
+
+        progress_bar.update(member.compress_size)
+        return p
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='unzip') as pool:
+            return list(pool.map(extract, members))
+    finally:
+        progress_bar.close()
+        for zf in handles:
+            _close_zip(zf)
+
+def _close_zip(zf: zipfile.ZipFile):
+    """Close zip and its RangeFile, zipfile doesn't close file objects passed to it"""
+    fp = zf.fp
+    zf.close()
+
+    if isinstance(fp, RangeFile):
+        fp.close()
+
+class RangeFile(object):
+    """Read only, seekable file backed by http range requests, eg to open a remote zip with zipfile
+    - reads are served from a read ahead buffer, refilled by one range request of buffer_size bytes
+    - next buffer is fetched in background while current one is consumed
+    - read ahead stops at limit (eg end of current zip member), reads past it still work
+    """
+
+    def __init__(self, url: str, size: int, buffer_size: int=8 * 1024 * 1024, retries: int=5, backoff: float=0.5):
+        self.url = url
+        self.size = size
+        self.buffer_size = buffer_size
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = size
+        self.pos = 0
+        self._buf = b''
+        self._buf_start = 0
+        self._next = None
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='range_prefetch')
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int=0) -> int:
+        base = {0: 0, 1: self.pos, 2: self.size}[whence]
+        self.pos = base + offset
+        return self.pos
+
+    def read(self, n: int=-1) -> bytes:
+        if n is None or n < 0:
+            n = self.size - self.pos
+
+        n = min(n, self.size - self.pos)
+        chunks = []
+
+        while n > 0:
+            i = self.pos - self._buf_start
+            if not 0 <= i < len(self._buf):
+                self._fill(n)
+                i = 0
+
+            data = self._buf[i:i + n]
+            chunks.append(data)
+            self.pos += len(data)
+            n -= len(data)
+
+        return b''.join(chunks)
+
+    def _fill(self, n: int):
+        """Fill buffer from current position, with prefetched range if it starts here"""
+        start = self.pos
+
+        if not self._next is None and self._next[0] == start:
+            buf = self._next[1].result()
+        else:
+            end = min(max(start + n, min(start + self.buffer_size, self.limit)), self.size) - 1
+            buf = self._fetch(start, end)
+
+        self._buf, self._buf_start = buf, start
+        self._next = None
+
+        # read ahead while caller consumes current buffer
+        start_next = start + len(buf)
+        if start_next < min(self.limit, self.size):
+            end_next = min(start_next + self.buffer_size, self.limit, self.size) - 1
+            self._next = (start_next, self._pool.submit(self._fetch, start_next, end_next))
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        def fetch() -> bytes:
+            with _get(self.url, headers={'Range': f'bytes={start}-{end}'}) as resp:
+                if not resp.status_code == 206 or not _range_start(resp) == start \
+                        or not len(resp.content) == end - start + 1:
+                    raise requests.exceptions.ChunkedEncodingError(f'Bad response for range {start}-{end}')
+
+                return resp.content
+
+        return _retry(fetch, retries=self.retries, backoff=self.backoff)
+
+    def close(self):
+        self._buf = b''
+        self._next = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
 def _input(msg : str) -> bool:
     """Get yes/no answer from user in terminal
 
@@ -0,0 +1,234 @@
+"""
+Build ml feature tables (one column of daily rain per climate model, plus observed rain) for
+any number of locations, without loading the combined rainfall dataset into memory
+
+Out of core version of milestone 2's
+`df.pivot(columns='model', values='rain').resample('D').mean().join(df_obs)`:
+- each dataset file (one per model partition) is scanned in a separate process, reading only
+    row groups which can contain a location (parquet statistics), in batches of batch_rows
+- each batch is reduced to daily sum/count of rain per (location, model), so memory per worker
+    is one batch plus one row per day per (location, model)
+- partial sums are combined, divided into daily means, pivoted to model columns, reindexed to
+    every day in range (same as resample('D')) and joined to observed rain
+- a location on the edge between grid cells gets the mean of both cells (pivot would raise on
+    the duplicate times)
+
+Output is written to `ml_data_{name}.parquet` with time index, ready for
+`ModelManager.make_train_test(df, target='observed_rain')`.
+
+Examples
+--------
+>>> from src import features
+>>> paths = features.build_features(locations=dict(SYD=(-33.86, 151.21)))
+>>> df = pd.read_parquet(paths['SYD'])
+>>> x_train, y_train, x_test, y_test = mm.make_train_test(df, target='observed_rain')
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from . import loader
+from .__init__ import getlog
+from .convert import cell_cols, p_data
+
+log = getlog(__name__)
+
+# name: (lat, lon)
+default_locations = dict(SYD=(-33.86, 151.21))
+
+
+def build_features(
+        locations: dict=None,
+        path: Union[Path, str]=None,
+        p_obs: Union[Path, str]=None,
+        obs_files: dict=None,
+        p_dst: Union[Path, str]=None,
+        workers: int=None,
+        batch_rows: int=1_000_000,
+        dropna: bool=True,
+        storage_options: dict=None) -> dict:
+    """Build and save feature table for each location
+
+    Parameters
+    ----------
+    locations : dict, optional
+        {name: (lat, lon)}, by default SYD
+    path : Union[Path, str], optional
+        rainfall dataset path or url, by default data/parquet/rainfall
+    p_obs : Union[Path, str], optional
+        dir (or url) of `observed_daily_rainfall_{name}.csv` files, by default data/csv
+    obs_files : dict, optional
+        {name: observed rainfall csv path or url}, overrides p_obs per location, by default None
+    p_dst : Union[Path, str], optional
+        dir (or url) to write `ml_data_{name}.parquet` to, by default data/output
+    workers : int, optional
+        processes scanning dataset files in parallel, by default cpu count
+    batch_rows : int, optional
+        max rows read into memory at once per worker, by default 1_000_000
+    dropna : bool, optional
+        drop days missing any model or observed rain, by default True
+    storage_options : dict, optional
+        credentials/endpoint for remote paths, by default None
+
+    Returns
+    -------
+    dict
+        {name: path of saved feature table}
+    """
+    if locations is None:
+        locations = default_locations
+
+    path = str(path if not path is None else loader.p_dataset)
+    p_obs = str(p_obs if not p_obs is None else p_data / 'csv')
+    p_dst = str(p_dst if not p_dst is None else p_data / 'output')
+    obs_files = obs_files or {}
+    workers = workers or os.cpu_count() or 1
+
+    df_daily = daily_rain(
+        locations=locations,
+        path=path,
+        workers=workers,
+        batch_rows=batch_rows,
+        storage_options=storage_options)
+
+    if not '://' in p_dst:
+        Path(p_dst).mkdir(parents=True, exist_ok=True)
+
+    paths = {}
+    for name in locations:
+        p_csv = str(obs_files.get(name, f'{p_obs}/observed_daily_rainfall_{name}.csv'))
+
+        try:
+            df_obs = pd \
+                .read_csv(p_csv, parse_dates=['time'], **_storage_kw(p_csv, storage_options)) \
+                .rename(columns={'rain (mm/day)': 'observed_rain'}) \
+                .set_index('time')
+        except FileNotFoundError:
+            log.warning(f'No observed rainfall for {name}, skipping: {p_csv}')
+            continue
+
+        df = pivot_daily(df_daily, name=name).join(df_obs)
+
+        if dropna:
+            df = df.dropna()
+
+        p = f'{p_dst}/ml_data_{name}.parquet'
+        df.to_parquet(p, **_storage_kw(p, storage_options))
+        log.info(f'Saved features for {name}: {df.shape}, {p}')
+        paths[name] = p
+
+    return paths
+
+
+def daily_rain(
+        locations: dict,
+        path: Union[Path, str]=None,
+        workers: int=1,
+        batch_rows: int=1_000_000,
+        storage_options: dict=None) -> pd.DataFrame:
+    """Daily mean rain per (location, model, day), scanning dataset files in parallel
+
+    Returns
+    -------
+    pd.DataFrame
+        columns location, model, time, rain
+    """
+    dset = loader.dataset(path=path, storage_options=storage_options)
+    _, root = loader.get_filesystem(path if not path is None else loader.p_dataset, storage_options=storage_options)
+    protocol = str(path).split('://')[0] + '://' if '://' in str(path) else ''
+
+    # one task per file, model from partition dir if not a column
+    tasks = [
+        dict(
+            path=protocol + fragment.path,
+            model=loader.partition_keys(fragment.path, root=root).get('model'),
+            locations=locations,
+            batch_rows=batch_rows,
+            storage_options=storage_options)
+        for fragment in dset.get_fragments()]
+
+    log.info(f'Aggregating {len(tasks)} files for {len(locations)} locations with {workers} workers')
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            dfs = list(pool.map(_aggregate_file, tasks))
+    else:
+        dfs = [_aggregate_file(task) for task in tasks]
+
+    # same (location, model, day) can be split across files/batches
+    return pd.concat(dfs) \
+        .groupby(['location', 'model', 'time']) \
+        .sum() \
+        .pipe(lambda df: (df['sum'] / df['count']).rename('rain')) \
+        .reset_index()
+
+
+def pivot_daily(df_daily: pd.DataFrame, name: str) -> pd.DataFrame:
+    """Pivot one location's daily rain to model columns, with a row for every day in range"""
+    df = df_daily[df_daily.location == name] \
+        .pivot(index='time', columns='model', values='rain') \
+        .rename_axis(columns=None)
+
+    if df.empty:
+        return df
+
+    return df.reindex(pd.date_range(df.index.min(), df.index.max(), freq='D', name='time'))
+
+
+def _aggregate_file(task: dict) -> pd.DataFrame:
+    """Read one dataset file in batches, reduce to daily rain sum/count per (location, model)"""
+    fs, path = loader.get_filesystem(task['path'], storage_options=task['storage_options'])
+    dset = ds.dataset(path, format='parquet', filesystem=fs)
+    names = dset.schema.names
+
+    rain_col = 'rain (mm/day)' if 'rain (mm/day)' in names else 'rain'
+    columns = ['time'] + cell_cols + [rain_col]
+    if 'model' in names:
+        columns.append('model')
+
+    # rows in any location's grid cell
+    expr = None
+    for lat, lon in task['locations'].values():
+        e = loader.make_filter(schema=dset.schema, point=(lat, lon))
+        expr = e if expr is None else expr | e
+
+    scanner = dset.scanner(columns=columns, filter=expr, batch_size=task['batch_rows'])
+    dfs = []
+
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+
+        df = batch.to_pandas()
+        if not 'model' in df.columns:
+            df['model'] = task['model']
+
+        df['time'] = df.time.dt.floor('D')
+
+        for name, (lat, lon) in task['locations'].items():
+            df_loc = df[(df.lat_min <= lat) & (df.lat_max >= lat) & (df.lon_min <= lon) & (df.lon_max >= lon)]
+
+            # batches usually hold only some locations' cells
+            if df_loc.empty:
+                continue
+
+            dfs.append(df_loc
+                .groupby(['model', 'time'])[rain_col]
+                .agg(['sum', 'count'])
+                .assign(location=name)
+                .reset_index())
+
+    if not dfs:
+        return pd.DataFrame(columns=['location', 'model', 'time', 'sum', 'count'])
+
+    return pd.concat(dfs)[['location', 'model', 'time', 'sum', 'count']]
+
+
+def _storage_kw(path: str, storage_options: dict) -> dict:
+    """pandas only accepts storage_options for fsspec urls"""
+    return dict(storage_options=storage_options) if '://' in path and not storage_options is None else {}
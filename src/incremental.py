@@ -0,0 +1,381 @@
+"""
+Incremental retraining of a fitted rainfall model on new days, without refitting on full history
+
+- scaling statistics of the fitted ColumnTransformer (MinMaxScaler, StandardScaler, MaxAbsScaler,
+    alone or as last step of a pipeline) are updated with partial_fit on the new rows only
+- scaling is affine per column, so split thresholds of the existing trees are mapped onto the
+    updated scale, and old trees predict exactly as before on new inputs
+- LightGBM continues boosting n_estimators more trees from the existing booster (init_model),
+    RandomForest/ExtraTrees/GradientBoosting add n_estimators more trees with warm_start
+- new version is saved next to the current one (see batch.save_model), so a ModelRegistry
+    watching the model dir or file swaps it in
+
+Examples
+--------
+>>> from src import incremental
+>>> pipe = mm.fit('lgbm')
+>>> pipe_inc, df_report = incremental.retrain(
+...     pipe, x_new, y_new, x_old=mm.x_train, y_old=mm.y_train, x_test=mm.x_test, y_test=mm.y_test)
+>>> p = incremental.retrain_saved('models/SYD', df_new=df_new, df_old=df_old)
+"""
+
+import copy
+import re
+import time
+from pathlib import Path
+from typing import Tuple, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MaxAbsScaler, MinMaxScaler, StandardScaler
+
+from . import batch
+from . import sklearn_helper_funcs as sf
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+affine_scalers = (MinMaxScaler, StandardScaler, MaxAbsScaler)
+
+
+def update_model(model, x_new: pd.DataFrame, y_new, n_estimators: int=10):
+    """Return copy of fitted model updated with new rows
+
+    Parameters
+    ----------
+    model : Pipeline | estimator
+        fitted Pipeline of (transformer, model), or fitted model on raw features
+    x_new : pd.DataFrame
+        new rows only
+    y_new : array-like
+    n_estimators : int, optional
+        trees to add, by default 10, lightgbm adds none (and warns) unless there are more than
+        2 * min_child_samples new rows to split
+
+    Returns
+    -------
+    Pipeline | estimator
+    """
+    model = copy.deepcopy(model)
+    y_new = np.asarray(y_new).ravel()
+
+    if isinstance(model, Pipeline):
+        if not len(model.steps) == 2:
+            raise ValueError(f'Only Pipeline of (transformer, model) supported, got steps: {list(model.named_steps)}')
+
+        trans, est = model.steps[0][1], model.steps[-1][1]
+
+        scale, shift = update_transformer(trans, x_new)
+        remap_thresholds(est, scale=scale, shift=shift)
+        xt_new = trans.transform(x_new)
+    else:
+        est, xt_new = model, x_new
+
+    continue_fit(est, xt_new, y_new, n_estimators=n_estimators)
+    return model
+
+
+def n_trees(model) -> int:
+    """Number of trees in fitted tree model, alone or last step of Pipeline"""
+    if isinstance(model, Pipeline):
+        model = model.steps[-1][1]
+
+    if hasattr(model, 'booster_'):
+        return model.booster_.num_trees()
+
+    return len(np.ravel(getattr(model, 'estimators_', [])))
+
+
+def update_transformer(trans, x: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """partial_fit affine scalers in transformer with x, return per output column (scale, shift)
+    mapping old transformed values to new: new = old * scale + shift
+    """
+    x0, x1 = _probes(x)
+    before = trans.transform(x0), trans.transform(x1)
+
+    if isinstance(trans, ColumnTransformer):
+        for _, t, cols in trans.transformers_:
+            x_cols = x.iloc[:, cols] if _is_int_cols(cols) else x[cols]
+            _partial_fit(t, x_cols)
+    else:
+        _partial_fit(trans, x)
+
+    after = trans.transform(x0), trans.transform(x1)
+
+    # transformed value = x * a + b for every column, before and after update
+    a_old, b_old = (before[1] - before[0]).ravel(), before[0].ravel()
+    a_new, b_new = (after[1] - after[0]).ravel(), after[0].ravel()
+
+    scale = np.divide(a_new, a_old, out=np.ones_like(a_new), where=~(a_old == 0))
+    shift = b_new - b_old * scale
+
+    n_changed = int((~np.isclose(scale, 1) | ~np.isclose(shift, 0)).sum())
+    log.info(f'Updated scaling of {n_changed}/{len(scale)} columns')
+
+    return scale, shift
+
+
+def remap_thresholds(model, scale: np.ndarray, shift: np.ndarray):
+    """Map split thresholds of fitted tree model (in place) from old to new transformed scale"""
+    if hasattr(model, 'booster_'):
+        model._Booster = _remap_lgbm(model.booster_, scale=scale, shift=shift)
+        return
+
+    trees = [model] if hasattr(model, 'tree_') else np.ravel(getattr(model, 'estimators_', []))
+    if len(trees) == 0:
+        raise ValueError(f'Can\'t remap thresholds for {type(model).__name__}')
+
+    for est in trees:
+        tree = est.tree_
+        split = tree.feature >= 0
+        feature = tree.feature[split]
+        tree.threshold[split] = tree.threshold[split] * scale[feature] + shift[feature]
+
+
+def continue_fit(model, x, y, n_estimators: int=10):
+    """Add n_estimators trees fitted on x, y to fitted model (in place)"""
+    if hasattr(model, 'booster_'):
+        booster = model.booster_
+        n_before = booster.num_trees()
+
+        model.set_params(n_estimators=n_estimators)
+        model.fit(x, y, init_model=booster)
+
+        # keep params matching fitted model, eg for clone
+        model.set_params(n_estimators=model.booster_.current_iteration())
+        log.info(f'Continued boosting: {n_before} -> {model.booster_.num_trees()} trees')
+
+        if model.booster_.num_trees() == n_before:
+            log.warning(
+                f'No trees added, lightgbm can\'t split {len(y)} new rows with '
+                f'min_child_samples={model.get_params()["min_child_samples"]}, model is unchanged')
+
+    elif 'warm_start' in model.get_params():
+        n_before = len(model.estimators_)
+
+        model.set_params(warm_start=True, n_estimators=n_before + n_estimators)
+        model.fit(x, y)
+        log.info(f'Warm started: {n_before} -> {len(model.estimators_)} trees')
+
+    else:
+        raise ValueError(f'{type(model).__name__} doesn\'t support incremental training')
+
+
+def retrain(
+        model,
+        x_new: pd.DataFrame,
+        y_new,
+        n_estimators: int=10,
+        x_old: pd.DataFrame=None,
+        y_old=None,
+        x_test: pd.DataFrame=None,
+        y_test=None) -> Tuple[object, pd.DataFrame]:
+    """Update model incrementally, and compare to full retrain on old + new rows if given
+
+    Parameters
+    ----------
+    model : Pipeline | estimator
+        fitted model
+    x_new, y_new :
+        new rows
+    n_estimators : int, optional
+        trees to add, by default 10
+    x_old, y_old : optional
+        rows model was fitted on, only used for full retrain comparison, by default None
+    x_test, y_test : optional
+        holdout rows for comparison, by default None (no comparison)
+
+    Returns
+    -------
+    Tuple[object, pd.DataFrame]
+        updated model, df of fit time and test scores for incremental/full (empty if no comparison)
+    """
+    t = time.perf_counter()
+    model_inc = update_model(model, x_new, y_new, n_estimators=n_estimators)
+    fit_times = dict(incremental=time.perf_counter() - t)
+
+    models = dict(incremental=model_inc)
+
+    if not x_test is None and not x_old is None:
+        t = time.perf_counter()
+        models['full'] = clone(model).fit(
+            pd.concat([x_old, x_new]),
+            np.concatenate([np.asarray(y_old).ravel(), np.asarray(y_new).ravel()]))
+        fit_times['full'] = time.perf_counter() - t
+
+    if x_test is None:
+        return model_inc, pd.DataFrame()
+
+    y_test = np.asarray(y_test).ravel()
+    rows = []
+
+    for name, m in models.items():
+        y_pred = m.predict(x_test)
+        rows.append(dict(
+            method=name,
+            fit_time=fit_times[name],
+            rmse=float(np.sqrt(np.mean((y_test - y_pred) ** 2))),
+            smape=float(sf.smape(y_test, y_pred))))
+
+    df = pd.DataFrame(rows).set_index('method')
+
+    if 'full' in models:
+        log.info(
+            f'Incremental vs full retrain: rmse {df.rmse.incremental:.4f} vs {df.rmse.full:.4f}, '
+            f'fit time {df.fit_time.incremental:.2f}s vs {df.fit_time.full:.2f}s')
+
+    return model_inc, df
+
+
+def retrain_saved(
+        p_model: Union[Path, str],
+        df_new: pd.DataFrame,
+        target: str='observed_rain',
+        n_estimators: int=10,
+        df_old: pd.DataFrame=None,
+        test_size: float=0.2) -> Path:
+    """Load current model, update it with new days and save new version for serving
+
+    Parameters
+    ----------
+    p_model : Union[Path, str]
+        model file, or dir of versioned models (newest is updated, new version added to dir)
+    df_new : pd.DataFrame
+        new days, feature columns + target
+    target : str, optional
+        by default 'observed_rain'
+    n_estimators : int, optional
+        trees to add, by default 10
+    df_old : pd.DataFrame, optional
+        previous days, if given the most recent test_size of new days is held out to compare
+        incremental vs full retrain (comparison only, the saved model is fitted on all new days)
+    test_size : float, optional
+        by default 0.2
+
+    Returns
+    -------
+    Path
+        saved model path
+    """
+    p_model = Path(p_model)
+    p_current = _newest_model(p_model) if p_model.is_dir() else p_model
+    model = joblib.load(p_current)
+
+    x_new, y_new = sf.split(df_new, target=target)
+    _, df_report = _compare_saved(model, df_new, df_old, target, n_estimators, test_size)
+
+    model_inc = update_model(model, x_new, y_new, n_estimators=n_estimators)
+
+    meta = dict(
+        parent=p_current.name,
+        n_new=len(df_new),
+        new_start=str(df_new.index.min()),
+        new_end=str(df_new.index.max()),
+        n_estimators_added=n_estimators,
+        comparison=df_report.to_dict(orient='index'))
+
+    if p_model.is_dir():
+        return batch.save_model(model_inc, p_dst=p_model, meta=meta)
+
+    # single model file, replace atomically so registry sees complete file
+    p_tmp = p_model.with_name(f'_{p_model.name}.tmp')
+    joblib.dump(model_inc, p_tmp)
+    p_tmp.replace(p_model)
+    return p_model
+
+
+def _compare_saved(model, df_new, df_old, target, n_estimators, test_size) -> Tuple[object, pd.DataFrame]:
+    """Hold out most recent days to compare incremental update of model vs full retrain"""
+    if df_old is None:
+        return None, pd.DataFrame()
+
+    df_new = df_new.sort_index()
+    n_test = int(len(df_new) * test_size)
+    if not 0 < n_test < len(df_new):
+        raise ValueError(f'test_size={test_size} leaves no new days to train or test on, n_new={len(df_new)}')
+
+    # old model only saw df_old, so refit it on those days for a fair comparison
+    x_old, y_old = sf.split(df_old, target=target)
+    x_new, y_new = sf.split(df_new.iloc[:-n_test], target=target)
+    x_test, y_test = sf.split(df_new.iloc[-n_test:], target=target)
+
+    base = clone(model).fit(x_old, y_old)
+    return retrain(base, x_new, y_new, n_estimators=n_estimators, x_old=x_old, y_old=y_old, x_test=x_test, y_test=y_test)
+
+
+def _newest_model(p_dir: Path, pattern: str='*.joblib') -> Path:
+    """Same file ModelRegistry serves from a dir: newest by mtime, then name"""
+    files = sorted(p_dir.glob(pattern), key=lambda p: (p.stat().st_mtime_ns, p.name))
+    if not files:
+        raise FileNotFoundError(f'No model file found at: {p_dir}')
+
+    return files[-1]
+
+
+def _probes(x: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Two rows of x with every numeric column set to 0 and 1"""
+    num_cols = x.select_dtypes('number').columns
+    x0, x1 = x.iloc[[0]].copy(), x.iloc[[0]].copy()
+    x0[num_cols] = 0.0
+    x1[num_cols] = 1.0
+    return x0, x1
+
+
+def _is_int_cols(cols) -> bool:
+    return all(isinstance(c, (int, np.integer)) for c in np.atleast_1d(cols))
+
+
+def _partial_fit(trans, x):
+    """partial_fit affine scaler, or last step of pipeline, other transformers are kept as is"""
+    if isinstance(trans, affine_scalers):
+        trans.partial_fit(x)
+
+    elif isinstance(trans, Pipeline) and isinstance(trans.steps[-1][1], affine_scalers):
+        trans.steps[-1][1].partial_fit(trans[:-1].transform(x))
+
+
+def _remap_lgbm(booster, scale: np.ndarray, shift: np.ndarray):
+    """Rewrite numerical split thresholds (and feature ranges) in lightgbm model string"""
+    import lightgbm as lgb
+
+    lines = booster.model_to_string().splitlines()
+    tree = {}
+
+    def remap_tree():
+        if 'threshold' in tree:
+            features = [int(v) for v in lines[tree['split_feature']].split('=', 1)[1].split()]
+            decision = [int(v) for v in lines[tree['decision_type']].split('=', 1)[1].split()]
+            thresholds = [float(v) for v in lines[tree['threshold']].split('=', 1)[1].split()]
+
+            # categorical splits (decision_type bit 0) hold category ids, not thresholds
+            vals = [t if d & 1 else t * scale[f] + shift[f] for t, f, d in zip(thresholds, features, decision)]
+            lines[tree['threshold']] = 'threshold=' + ' '.join(repr(float(v)) for v in vals)
+
+        tree.clear()
+
+    for i, line in enumerate(lines):
+        key = line.split('=', 1)[0]
+
+        if key == 'Tree':
+            remap_tree()
+        elif key in ('split_feature', 'threshold', 'decision_type'):
+            tree[key] = i
+        elif key == 'feature_infos':
+            infos = line.split('=', 1)[1].split(' ')
+            for f, info in enumerate(infos):
+                m = re.fullmatch(r'\[(.+):(.+)\]', info)
+                if m:
+                    lo, hi = [float(v) * scale[f] + shift[f] for v in m.groups()]
+                    infos[f] = f'[{lo!r}:{hi!r}]'
+
+            lines[i] = 'feature_infos=' + ' '.join(infos)
+
+    remap_tree()
+
+    # tree_sizes holds byte offsets of each tree, stale after rewrite, lightgbm parses trees in order without it
+    lines = [line for line in lines if not line.startswith('tree_sizes=')]
+    return lgb.Booster(model_str='\n'.join(lines) + '\n')
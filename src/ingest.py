@@ -0,0 +1,148 @@
+"""
+Fast request body parsing into float64 arrays, with vectorized validation
+- raw little-endian float64 bodies are viewed in place with no copy or python objects
+- JSON bodies are decoded with orjson if installed, then converted to float64 in one step
+
+Examples
+--------
+>>> from src import ingest
+>>> x = ingest.parse_json(b'{"data": [1, 2, 3]}')
+>>> ingest.check_array(x, n_features=3, ndim=1)
+array([1., 2., 3.])
+"""
+
+import json
+from typing import Union
+
+import numpy as np
+
+# orjson decodes roughly 2x faster than json, but is optional
+try:
+    import orjson
+    _loads = orjson.loads
+    _decode_errors = (ValueError, orjson.JSONDecodeError)
+
+except ImportError:
+    _loads = json.loads
+    _decode_errors = (ValueError, )
+
+
+def loads(data: bytes) -> Union[dict, list, None]:
+    """Decode JSON request body with fastest available parser
+
+    Raises
+    ------
+    ValueError
+        invalid JSON
+    """
+    if not data:
+        return None
+
+    try:
+        return _loads(data)
+    except _decode_errors:
+        raise ValueError('Input data incorrect format.')
+
+
+def to_array(input_vals: list) -> Union[np.ndarray, None]:
+    """Convert decoded list of numbers to float64 array in one step
+
+    Returns
+    -------
+    Union[np.ndarray, None]
+        None if values aren't all numbers, are too large for float64, or rows are ragged
+    """
+    try:
+        return np.array(input_vals, dtype=np.float64)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def parse_binary(data: bytes, n_features: int) -> np.ndarray:
+    """Zero copy view of raw little-endian float64 body as (n, n_features) array
+
+    Raises
+    ------
+    ValueError
+        body isn't whole rows of float64
+    """
+    row_bytes = n_features * 8
+
+    if len(data) == 0 or not len(data) % row_bytes == 0:
+        raise ValueError(
+            f'Binary input must be a multiple of {row_bytes} bytes (rows of {n_features} float64), your input bytes: {len(data)}')
+
+    return np.frombuffer(data, dtype='<f8').reshape(-1, n_features)
+
+
+def parse_json(data: bytes) -> np.ndarray:
+    """Decode single key JSON payload of numbers, eg {"data": [[1, 2], [3, 4]]}, to float64 array
+
+    Raises
+    ------
+    ValueError
+        not a single key object of numbers
+    """
+    content = loads(data)
+
+    if not isinstance(content, dict) or len(content) == 0:
+        raise ValueError('Input data incorrect format.')
+
+    x = to_array(list(content.values())[0])
+    if x is None:
+        raise ValueError('Input data must only contain numbers.')
+
+    return x
+
+
+def check_array(
+        x: np.ndarray,
+        n_features: int,
+        ndim: int = 2,
+        min_val: float = 0,
+        max_val: float = 250) -> np.ndarray:
+    """Vectorized check of dtype, shape and value range
+
+    Parameters
+    ----------
+    x : np.ndarray
+    n_features : int
+        required length of last axis
+    ndim : int, optional
+        1 for single row, 2 for batch, by default 2
+    min_val : float, optional
+        by default 0
+    max_val : float, optional
+        by default 250
+
+    Returns
+    -------
+    np.ndarray
+        same array, for chaining
+
+    Raises
+    ------
+    ValueError
+        wrong dtype/shape or values outside [min_val, max_val] (includes nan/inf)
+    """
+    if not x.dtype == np.float64:
+        raise ValueError(f'Input must be float64, your input dtype: {x.dtype}')
+
+    if not (x.ndim == ndim and x.shape[-1] == n_features):
+        shape = f'({n_features},)' if ndim == 1 else f'(n, {n_features})'
+        raise ValueError(f'Input must have shape {shape}, your input shape: {x.shape}')
+
+    # nan fails both comparisons, so is caught as out of range
+    in_range = (x >= min_val) & (x <= max_val)
+
+    if not in_range.all():
+        if ndim == 1:
+            bad = np.flatnonzero(~in_range)
+            raise ValueError(
+                f'Input values must be between {min_val} and {max_val}, bad positions: {bad[:10].tolist()}')
+        else:
+            bad = np.flatnonzero(~in_range.all(axis=1))
+            raise ValueError(
+                f'Input values must be between {min_val} and {max_val}, bad rows: {bad[:10].tolist()}')
+
+    return x
@@ -0,0 +1,211 @@
+"""
+Load subsets of the combined rainfall parquet dataset without reading all of it
+
+Location, time and model filters are passed to the pyarrow dataset scan, so whole partitions
+(model dirs) and row groups whose lat/lon/time statistics can't match are skipped, and only the
+requested columns are read. Works on local paths and on s3 (or any fsspec url), with
+credentials/endpoint given as pandas style storage_options.
+
+Examples
+--------
+>>> from src import loader
+>>> df = loader.load(point=(-33.86, 151.21), start='1980', end='2000', models=['ACCESS-CM2'])
+>>> df = loader.load(
+...     's3://bucket/combined_model_data_parti.parquet',
+...     bbox=(-34.5, -33.5, 150.5, 151.5),
+...     columns=['time', 'rain', 'model'],
+...     storage_options=dict(key=key, secret=secret, endpoint_url='http://localhost:5000'))
+"""
+
+from pathlib import Path
+from typing import Union
+from urllib.parse import unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from .__init__ import getlog
+from .convert import cell_cols, p_data
+
+log = getlog(__name__)
+
+# default dataset written by convert.csv_to_parquet
+p_dataset = p_data / 'parquet' / 'rainfall'
+
+
+def get_filesystem(path: Union[Path, str], storage_options: dict=None) -> tuple:
+    """Return (filesystem, path) for pyarrow, filesystem is None for local paths
+
+    Parameters
+    ----------
+    path : Union[Path, str]
+        local path or url, eg 's3://bucket/data.parquet'
+    storage_options : dict, optional
+        passed to fsspec filesystem, eg key, secret, endpoint_url, by default None
+
+    Returns
+    -------
+    tuple
+        (filesystem, path without protocol)
+    """
+    path = str(path)
+    if not '://' in path or path.startswith('file://'):
+        return None, path.replace('file://', '')
+
+    import fsspec
+
+    storage_options = dict(storage_options or {})
+
+    # older s3fs only accept endpoint inside client_kwargs
+    if path.startswith('s3://') and 'endpoint_url' in storage_options:
+        client_kwargs = storage_options.setdefault('client_kwargs', {})
+        client_kwargs['endpoint_url'] = storage_options.pop('endpoint_url')
+
+    fs, fs_path = fsspec.core.url_to_fs(path, **storage_options)
+    return fs, fs_path
+
+
+def dataset(path: Union[Path, str]=None, storage_options: dict=None) -> ds.Dataset:
+    """Open parquet dataset (single file or hive partitioned dir) at path"""
+    if path is None:
+        path = p_dataset
+
+    fs, path = get_filesystem(path, storage_options=storage_options)
+    return ds.dataset(path, format='parquet', partitioning='hive', filesystem=fs)
+
+
+def partition_keys(path: str, root: str) -> dict:
+    """{key: value} of hive partition dirs between dataset root and file, eg {'model': 'ACCESS-CM2'}
+
+    Parsed from the file path, with the `key=value` dir layout convert.csv_to_parquet writes,
+    values url decoded like pyarrow's hive partitioning
+    """
+    path, root = str(path), str(root).rstrip('/')
+    rel = path[len(root):] if path.startswith(root) else path
+    keys = {}
+
+    # last part is file name
+    for part in rel.strip('/').split('/')[:-1]:
+        if '=' in part:
+            key, val = part.split('=', 1)
+            keys[unquote(key)] = None if val == '__HIVE_DEFAULT_PARTITION__' else unquote(val)
+
+    return keys
+
+
+def make_filter(
+        schema: pa.Schema,
+        point: tuple=None,
+        bbox: tuple=None,
+        start=None,
+        end=None,
+        models: list=None) -> ds.Expression:
+    """Build dataset filter expression, None if no filters given
+
+    Parameters
+    ----------
+    schema : pa.Schema
+        dataset schema, used to match time type
+    point : tuple, optional
+        (lat, lon), keep grid cells containing point, by default None
+    bbox : tuple, optional
+        (lat_min, lat_max, lon_min, lon_max), keep grid cells overlapping box, by default None
+    start : any, optional
+        keep time >= start, anything pd.Timestamp accepts, by default None
+    end : any, optional
+        keep time < end, by default None
+    models : list, optional
+        keep only these models, by default None
+
+    Returns
+    -------
+    ds.Expression
+    """
+    lat_min, lat_max, lon_min, lon_max = [ds.field(col) for col in cell_cols]
+    exprs = []
+
+    if not point is None:
+        lat, lon = point
+        exprs.extend([lat_min <= lat, lat_max >= lat, lon_min <= lon, lon_max >= lon])
+
+    if not bbox is None:
+        box_lat_min, box_lat_max, box_lon_min, box_lon_max = bbox
+        exprs.extend([
+            lat_max >= box_lat_min,
+            lat_min <= box_lat_max,
+            lon_max >= box_lon_min,
+            lon_min <= box_lon_max])
+
+    # compare as same timestamp type as column, so statistics can be used
+    time_type = schema.field('time').type
+    for val, op in ((start, '__ge__'), (end, '__lt__')):
+        if not val is None:
+            scalar = pa.scalar(pd.Timestamp(val).to_pydatetime(), type=time_type)
+            exprs.append(getattr(ds.field('time'), op)(scalar))
+
+    if not models is None:
+        exprs.append(ds.field('model').isin(list(models)))
+
+    if not exprs:
+        return None
+
+    expr = exprs[0]
+    for e in exprs[1:]:
+        expr = expr & e
+
+    return expr
+
+
+def load(
+        path: Union[Path, str]=None,
+        point: tuple=None,
+        bbox: tuple=None,
+        start=None,
+        end=None,
+        models: list=None,
+        columns: list=None,
+        storage_options: dict=None) -> pd.DataFrame:
+    """Load filtered rows/columns of rainfall dataset
+
+    Parameters
+    ----------
+    path : Union[Path, str], optional
+        dataset path or url, by default data/parquet/rainfall
+    point : tuple, optional
+        (lat, lon), keep grid cells containing point, by default None
+    bbox : tuple, optional
+        (lat_min, lat_max, lon_min, lon_max), keep grid cells overlapping box, by default None
+    start : any, optional
+        keep time >= start, by default None
+    end : any, optional
+        keep time < end, by default None
+    models : list, optional
+        keep only these models, by default None
+    columns : list, optional
+        columns to return, by default all
+    storage_options : dict, optional
+        credentials/endpoint for remote paths, eg key, secret, endpoint_url, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    dset = dataset(path=path, storage_options=storage_options)
+
+    # figshare's combined dataset still has original rain column name
+    rename = {'rain (mm/day)': 'rain'} if 'rain (mm/day)' in dset.schema.names else {}
+    if rename and not columns is None:
+        columns = ['rain (mm/day)' if col == 'rain' else col for col in columns]
+
+    expr = make_filter(
+        schema=dset.schema,
+        point=point,
+        bbox=bbox,
+        start=start,
+        end=end,
+        models=models)
+
+    return dset.to_table(columns=columns, filter=expr) \
+        .to_pandas() \
+        .rename(columns=rename)
@@ -0,0 +1,158 @@
+"""
+Minimal in-process Prometheus style metrics, exposed as text from the /metrics endpoint
+
+Examples
+--------
+>>> from src.metrics import Counter, Histogram, MetricsRegistry
+>>> metrics = MetricsRegistry()
+>>> requests = metrics.add(Counter('requests_total', 'Requests', labelnames=('endpoint', )))
+>>> requests.inc(endpoint='/predict')
+>>> latency = metrics.add(Histogram('stage_seconds', 'Stage time', labelnames=('stage', )))
+>>> with latency.time(stage='parse'):
+...     parse()
+>>> print(metrics.render())
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, from 50us to 10s
+default_buckets = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt_labels(labelnames: tuple, values: tuple, extra: dict = None) -> str:
+    items = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not items:
+        return ''
+
+    def escape(v): return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in items) + '}'
+
+
+class Metric(object):
+    type_ = ''
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self) -> list:
+        return [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.type_}']
+
+
+class Counter(Metric):
+    """Monotonically increasing count, eg requests or errors"""
+    type_ = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = super().render()
+        with self._lock:
+            for key, val in sorted(self._values.items()):
+                lines.append(f'{self.name}{_fmt_labels(self.labelnames, key)} {val}')
+
+        return lines
+
+
+class Gauge(Metric):
+    """Value which can go up or down, eg model info"""
+    type_ = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list:
+        lines = super().render()
+        with self._lock:
+            for key, val in sorted(self._values.items()):
+                lines.append(f'{self.name}{_fmt_labels(self.labelnames, key)} {val}')
+
+        return lines
+
+
+class Histogram(Metric):
+    """Cumulative bucketed observations, eg latency in seconds"""
+    type_ = 'histogram'
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = (), buckets: tuple = default_buckets):
+        super().__init__(name=name, doc=doc, labelnames=labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                # per bucket counts (+inf last), sum
+                item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            item[0][i] += 1
+            item[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe seconds spent inside with block"""
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def render(self) -> list:
+        lines = super().render()
+
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        for key, (counts, total) in items:
+            cum = 0
+            for le, count in zip(self.buckets + ('+Inf', ), counts):
+                cum += count
+                lines.append(f'{self.name}_bucket{_fmt_labels(self.labelnames, key, dict(le=le))} {cum}')
+
+            lines.append(f'{self.name}_sum{_fmt_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_fmt_labels(self.labelnames, key)} {cum}')
+
+        return lines
+
+
+class MetricsRegistry(object):
+    """Collection of metrics rendered together in Prometheus text format"""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,196 @@
+"""
+Versioned model registry which watches a model file or directory and hot swaps new versions
+
+Examples
+--------
+>>> from src.registry import ModelRegistry
+>>> registry = ModelRegistry('model.joblib', poll_interval=5)
+>>> model, version = registry.active
+>>> model.predict(x)
+"""
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Tuple, Union
+
+import joblib
+
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+
+def file_version(p: Path) -> str:
+    """Short content hash version string for model file, eg 'model-3f2a9b1c'"""
+    md5 = hashlib.md5()
+    with open(p, 'rb') as file:
+        for data in iter(lambda: file.read(1024 * 1024), b''):
+            md5.update(data)
+
+    return f'{p.stem}-{md5.hexdigest()[:8]}'
+
+
+class ModelRegistry(object):
+    """Hold active (model, version) and swap in new model versions without dropping requests
+    - path can be a single model file, or a directory where the newest *.joblib file is active
+    - new versions are loaded in a background thread, then swapped in with a single assignment,
+    so requests always see a complete (model, version) pair
+    - a changed file is only loaded once its size/mtime are unchanged between two polls,
+    so half-copied files are skipped
+    """
+
+    def __init__(
+            self,
+            path: Union[Path, str],
+            poll_interval: float = 5.0,
+            mmap_mode: str = 'r',
+            pattern: str = '*.joblib',
+            wrap: Callable = None):
+        """
+        Parameters
+        ----------
+        path : Union[Path, str]
+            model file or directory of versioned model files
+        poll_interval : float, optional
+            seconds between checks for new model, 0 to disable watching, by default 5.0
+        mmap_mode : str, optional
+            passed to joblib.load, memory maps numpy arrays in uncompressed dumps, by default 'r'
+        pattern : str, optional
+            glob for model files when path is a directory, by default '*.joblib'
+        wrap : Callable, optional
+            func(model) applied to each loaded model before swap in, eg compile_model, by default None
+        """
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self.mmap_mode = mmap_mode
+        self.pattern = pattern
+        self.wrap = wrap
+
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = None
+
+        p = self._find_file()
+        if p is None:
+            raise FileNotFoundError(f'No model file found at: {self.path}')
+
+        self._stat = self._stat_file(p)
+        self._active = self._load(p)
+
+    @property
+    def active(self) -> Tuple[object, str]:
+        """Current (model, version), read once per request for a consistent pair"""
+        self._ensure_started()
+        return self._active
+
+    @property
+    def model(self):
+        return self.active[0]
+
+    @property
+    def version(self) -> str:
+        return self.active[1]
+
+    def on_change(self, func: Callable):
+        """Register func(version) to call after a new model is swapped in, eg clear caches"""
+        self._callbacks.append(func)
+
+    def reload(self, force: bool = False) -> bool:
+        """Load and swap in model if file changed since last load
+
+        Parameters
+        ----------
+        force : bool, optional
+            reload even if file unchanged, by default False
+
+        Returns
+        -------
+        bool
+            True if new model swapped in
+        """
+        p = self._find_file()
+        if p is None:
+            log.warning(f'No model file found at: {self.path}, keeping {self._active[1]}')
+            return False
+
+        stat = self._stat_file(p)
+
+        if not force:
+            if stat == self._stat:
+                self._pending = None
+                return False
+
+            # wait until file stops changing before loading
+            if not stat == self._pending:
+                self._pending = stat
+                return False
+
+        self._pending = None
+
+        # file touched/copied but content unchanged
+        version = file_version(p)
+        if version == self._active[1] and not force:
+            self._stat = stat
+            return False
+
+        try:
+            model, version = self._load(p, version=version)
+        except Exception as e:
+            log.error(f'Failed to load model {p}, keeping {self._active[1]}: {e}')
+            return False
+
+        self._stat = stat
+        self._active = (model, version)
+        log.info(f'Swapped in model version: {version}')
+
+        for func in self._callbacks:
+            func(version)
+
+        return True
+
+    def _find_file(self) -> Union[Path, None]:
+        if self.path.is_dir():
+            files = sorted(self.path.glob(self.pattern), key=lambda p: (p.stat().st_mtime_ns, p.name))
+            return files[-1] if files else None
+
+        return self.path if self.path.exists() else None
+
+    @staticmethod
+    def _stat_file(p: Path) -> tuple:
+        st = p.stat()
+        return (str(p), st.st_size, st.st_mtime_ns)
+
+    def _load(self, p: Path, version: str = None) -> Tuple[object, str]:
+        t = time.perf_counter()
+        if version is None:
+            version = file_version(p)
+
+        model = joblib.load(p, mmap_mode=self.mmap_mode)
+
+        if not self.wrap is None:
+            model = self.wrap(model)
+
+        log.info(f'Loaded model {version} in {time.perf_counter() - t:.2f}s')
+
+        return model, version
+
+    def _ensure_started(self):
+        """Lazily start watcher thread (only once, and after any fork)"""
+        if self.poll_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._watch, name='ModelRegistry', daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                log.error(f'Model watcher error: {e}')
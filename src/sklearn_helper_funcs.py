@@ -1,23 +1,32 @@
+import inspect
 import json
 import pickle
 import re
+import tempfile
 import time
 from pathlib import Path
+from typing import Union
 from IPython.core.display import display_pdf
 
 import numpy as np
 import pandas as pd
 from IPython.display import display
+from joblib import Memory, Parallel, cpu_count, delayed, effective_n_jobs, parallel_backend
 from matplotlib.colors import LinearSegmentedColormap, ListedColormap # type: ignore
 from seaborn import diverging_palette
+from lightgbm import LGBMRegressor
+from lightgbm import early_stopping as lgbm_early_stopping
+from sklearn.base import clone, is_classifier
 from sklearn.compose import ColumnTransformer
 from sklearn.feature_extraction.text import CountVectorizer, _VectorizerMixin
 from sklearn.feature_selection import SelectKBest
 from sklearn.feature_selection._base import SelectorMixin
+from sklearn.experimental import enable_halving_search_cv  # noqa
 from sklearn.metrics import (accuracy_score, classification_report, f1_score,
                              make_scorer, recall_score)
-from sklearn.model_selection import (GridSearchCV, RandomizedSearchCV,
-                                     cross_val_score, cross_validate,
+from sklearn.model_selection import (GridSearchCV, HalvingGridSearchCV,
+                                     HalvingRandomSearchCV, RandomizedSearchCV,
+                                     check_cv, cross_val_score, cross_validate,
                                      train_test_split)
 from sklearn.pipeline import Pipeline
 from sklearn.decomposition import PCA
@@ -48,15 +57,27 @@ class ModelManager(object):
     """Manager class to perform cross val etc on multiple models with same underlying column transformer + data
     """
 
-    def __init__(self, ct=None, scoring=None, cv_args=None, random_state=0, target: str = 'target', **kw):
+    def __init__(self, ct=None, scoring=None, cv_args=None, random_state=0, target: str = 'target', memory=None, cache_limit='1G', **kw):
+        """
+        Parameters
+        ----------
+        memory : bool | str | Path | joblib.Memory, optional
+            cache fitted ColumnTransformer (and any extra steps) per fold, keyed on the fold's data and
+            transformer params, so models/searches on the same features don't refit it. True uses a dir
+            in the system temp dir, by default None (no caching)
+        cache_limit : str | int, optional
+            max size of cache on disk, oldest entries removed after each cross_val/search, by default '1G'
+        """
         random_state = random_state
         cv_args = cv_args if not cv_args is None else {}
+        memory = make_memory(memory)
         df_results = pd.DataFrame()
         pipes = {}
         scores = {}
         models = {}
         grids = {}
         df_preds = {}
+        backtests = {}
         v = {**vars(), **kw}
         set_self(v)
 
@@ -125,6 +146,7 @@ class ModelManager(object):
             models = {f'{name}_{param_name}': model}
             self.cross_val(models=models, show=False, df_scores=df_scores_features)
 
+        self.reduce_cache()
         self.show(df=df_scores_features)
 
     def timeit(self, func, *args, **kw):
@@ -166,7 +188,7 @@ class ModelManager(object):
             steps=[
                 ('ct', self.ct),
                 (name, model)],
-            # memory=str(p_tmp)
+            memory=self.memory
             # ('pca', PCA(n_components=20)),
         )
 
@@ -181,7 +203,7 @@ class ModelManager(object):
 
         return pipe
 
-    def cross_val(self, models: dict, show: bool = True, steps: list = None, df_scores=None, **kw):
+    def cross_val(self, models: dict, show: bool = True, steps: list = None, df_scores=None, parallel: bool = False, **kw):
         """Perform cross validation on multiple classifiers
 
         Parameters
@@ -192,6 +214,9 @@ class ModelManager(object):
             show dataframe of results, default True
         steps : list, optional
             list of tuples of [(step_pos, (name, model)), ]
+        parallel : bool, optional
+            run every (model, fold) as one pool of cv_args['n_jobs'] processes instead of one model at a
+            time, see cross_val_parallel, default False
         """
         if self.ct is None:
             raise AttributeError('ColumnTransformer not init!')
@@ -199,6 +224,7 @@ class ModelManager(object):
         if df_scores is None:
             df_scores = self.df_results
 
+        pipes = {}
         for name, model in models.items():
 
             # allow passing model definition, or instantiated model
@@ -210,10 +236,17 @@ class ModelManager(object):
             # safe model/pipeline by name
             self.models[name] = model
 
-            pipe = self.make_pipe(name=name, model=model, steps=steps)
+            pipes[name] = self.make_pipe(name=name, model=model, steps=steps)
 
-            scores = cross_validate(
-                pipe, self.x_train, self.y_train.values.ravel(), error_score='raise', **self.cv_args)
+        if parallel:
+            m_scores = self.cross_val_parallel(pipes=pipes)
+
+        for name, pipe in pipes.items():
+            if parallel:
+                scores = m_scores[name]
+            else:
+                scores = cross_validate(
+                    pipe, self.x_train, self.y_train.values.ravel(), error_score='raise', **self.cv_args)
 
             self.scores[name] = scores
             df_scores = df_scores \
@@ -223,8 +256,74 @@ class ModelManager(object):
                     name=name,
                     scoring=self.cv_args.get('scoring', None))
 
+        self.reduce_cache()
+
         if show:
             self.show(**kw)
+
+    def cross_val_parallel(self, pipes: dict) -> dict:
+        """Cross validate all (model, fold) pairs from one cross_val call as a single pool of tasks
+        - small models no longer leave cores idle, and each process gets an even share of threads
+        for models with n_jobs (eg LightGBM) instead of each model using all cores
+        - x_train/y_train are memory mapped once and shared read only by all worker processes
+        - each task is a single split cross_validate, so scores are the same as cross_validate's
+
+        Parameters
+        ----------
+        pipes : dict
+            {name: pipeline}
+
+        Returns
+        -------
+        dict
+            {name: scores} in same format as cross_validate
+        """
+        cv_args = dict(self.cv_args)
+        n_jobs = effective_n_jobs(cv_args.pop('n_jobs', None))
+        cv = cv_args.pop('cv', None)
+
+        x = self.x_train
+        y = np.asarray(self.y_train).ravel()
+
+        tasks = []
+        for name, pipe in pipes.items():
+            splits = check_cv(cv, y, classifier=is_classifier(pipe)).split(x, y)
+            tasks.extend((name, train, test) for train, test in splits)
+
+        n_workers = max(1, min(n_jobs, len(tasks)))
+        n_threads = max(1, cpu_count() // n_workers)
+
+        with parallel_backend('loky', inner_max_num_threads=n_threads):
+            results = Parallel(n_jobs=n_workers, max_nbytes='1M', mmap_mode='r')(
+                delayed(_cross_validate_split)(
+                    pipes[name], name, x, y, train=train, test=test, n_jobs=n_threads, **cv_args)
+                for name, train, test in tasks)
+
+        # concat single fold results back into per model arrays, in fold order
+        m_scores = {}
+        for (name, _, _), result in zip(tasks, results):
+            m_scores.setdefault(name, []).append(result)
+
+        return {
+            name: {k: np.concatenate([r[k] for r in fold_results]) for k in fold_results[0]}
+            for name, fold_results in m_scores.items()}
+
+    def reduce_cache(self):
+        """Remove oldest cached transformers until cache is under cache_limit"""
+        if self.memory is None:
+            return
+
+        # joblib<1.3 (pinned 1.0.1) only reads limit from Memory.bytes_limit, newer versions take it
+        # in reduce_size and removed it from Memory in 1.5
+        if 'bytes_limit' in inspect.signature(self.memory.reduce_size).parameters:
+            self.memory.reduce_size(bytes_limit=self.cache_limit)
+        else:
+            self.memory.bytes_limit = self.cache_limit
+            self.memory.reduce_size()
+
+    def clear_cache(self):
+        if not self.memory is None:
+            self.memory.clear(warn=False)
         
     def show(self, df=None, **kw):
         if df is None:
@@ -296,8 +395,8 @@ class ModelManager(object):
     def best_est(self, name: str):
         return self.grids[name].best_estimator_
 
-    def search(self, name: str, params: dict=None, estimator=None, search_type: str = 'random', **kw):
-        """Perform Random or Grid search to optimize params on specific model
+    def search(self, name: str, params: dict=None, estimator=None, search_type: str = 'random', early_stopping: int = None, **kw):
+        """Perform Random, Grid or successive halving search to optimize params on specific model
 
         Parameters
         ----------
@@ -308,11 +407,19 @@ class ModelManager(object):
         estimator : sklearn model/Pipeline, optional
             pass in model if not init already, default None
         search_type : str, optional
-            RandomSearchCV or GridSearchCV, default 'random'
+            'random', 'grid' (RandomSearchCV or GridSearchCV), or 'halving_random', 'halving_grid'
+            (HalvingRandomSearchCV, HalvingGridSearchCV) which fit all candidates on a small budget and
+            only keep the best 1/factor for each larger budget, default 'random'
+            - budget is rows of x_train by default, or kw resource='n_estimators' (or any other param
+            of the model) with kw max_resources, default the model's current value
+            - halving searches only support one scoring metric, kw refit or first of cv_args scoring used
+        early_stopping : int, optional
+            LightGBM only, fit each candidate with validation_fraction of the training fold held out and
+            stop adding trees after this many rounds without improvement, default None
 
         Returns
         -------
-        RandomSearchCV | GridSearchCV
+        RandomSearchCV | GridSearchCV | HalvingRandomSearchCV | HalvingGridSearchCV
             sklearn model_selection object
         """
         # TODO need to enable NO renaming
@@ -327,25 +434,39 @@ class ModelManager(object):
         if estimator is None:
             estimator = self.pipes[name]
 
+        if not early_stopping is None:
+            estimator = with_early_stopping(estimator, name=name, stopping_rounds=early_stopping)
+
         m = dict(
             random=dict(
                 cls=RandomizedSearchCV,
                 param_name='param_distributions'),
             grid=dict(
                 cls=GridSearchCV,
+                param_name='param_grid'),
+            halving_random=dict(
+                cls=HalvingRandomSearchCV,
+                param_name='param_distributions'),
+            halving_grid=dict(
+                cls=HalvingGridSearchCV,
                 param_name='param_grid')) \
             .get(search_type)
 
+        cv_args = self.cv_args
+        if search_type.startswith('halving'):
+            cv_args = halving_args(name=name, estimator=estimator, params=params, cv_args=cv_args, kw=kw)
+
         # grid/random have different kw for param grid/distribution
         kw[m['param_name']] = params
 
         grid = m['cls'](
             estimator=estimator,
             **kw,
-            **self.cv_args) \
+            **cv_args) \
             .fit(self.x_train, self.y_train.values.ravel())
 
         self.grids[name] = grid
+        self.reduce_cache()
 
         results = {
             'Best params': grid.best_params_,
@@ -355,6 +476,38 @@ class ModelManager(object):
 
         return grid
 
+    def backtest(self, name: str, df: pd.DataFrame, model=None, target: str = None, **kw) -> pd.DataFrame:
+        """Rolling origin backtest of model pipeline on time ordered df, see backtest.rolling_origin
+
+        Parameters
+        ----------
+        name : str
+            model name, uses model from previous cross_val if model not given
+        df : pd.DataFrame
+            features + target, time index
+        target : str, optional
+            by default self.target
+        kw :
+            passed to backtest.rolling_origin, eg horizon, step, refit_every, n_jobs
+
+        Returns
+        -------
+        pd.DataFrame
+            scores per horizon, scores/predictions/fits also saved to self.backtests[name]
+        """
+        from .backtest import rolling_origin
+
+        model = model if not model is None else self.models[name]
+        pipe = self.make_pipe(name=name, model=model)
+
+        x, y = split(df.sort_index(), target=target or self.target)
+        df_scores, df_pred, df_origins = rolling_origin(pipe, x, y, **kw)
+
+        self.backtests[name] = dict(scores=df_scores, preds=df_pred, fits=df_origins)
+        self.reduce_cache()
+
+        return df_scores
+
     def save_model(self, name: str, **kw):
         model = self.get_model(name=name, **kw)
 
@@ -704,6 +857,119 @@ def inverse(m: dict) -> dict:
     return {v: k for k, v in m.items()}
 
 
+class LGBMEarlyStopping(LGBMRegressor):
+    """LGBMRegressor which holds out part of each training set to stop adding trees early
+    - n_estimators is the max number of trees, fitted model uses best_iteration_ for predictions
+    - all LGBMRegressor params are kept, so search params like 'lgbm__max_depth' work unchanged
+    """
+
+    def __init__(self, validation_fraction: float = 0.1, stopping_rounds: int = 10, **kw):
+        self.validation_fraction = validation_fraction
+        self.stopping_rounds = stopping_rounds
+        super().__init__(**kw)
+
+    @classmethod
+    def _get_param_names(cls):
+        return sorted(set(LGBMRegressor._get_param_names()) | {'validation_fraction', 'stopping_rounds'})
+
+    def fit(self, X, y, **kw):
+        if self.validation_fraction and not 'eval_set' in kw:
+            X, x_val, y, y_val = train_test_split(
+                X, y, test_size=self.validation_fraction, random_state=self.random_state)
+
+            kw['eval_set'] = [(x_val, y_val)]
+            kw['callbacks'] = list(kw.get('callbacks') or []) + [
+                lgbm_early_stopping(self.stopping_rounds, verbose=False)]
+
+        return super().fit(X, y, **kw)
+
+
+def with_early_stopping(estimator, name: str, stopping_rounds: int = 10, validation_fraction: float = 0.1):
+    """Return copy of pipeline (or model) with LightGBM model step replaced by LGBMEarlyStopping"""
+    pipe = clone(estimator)
+    model = pipe.named_steps[name] if isinstance(pipe, Pipeline) else pipe
+
+    if not isinstance(model, LGBMRegressor):
+        raise ValueError(f'Early stopping only supported for LGBMRegressor, not {type(model).__name__}')
+
+    params = {k: v for k, v in model.get_params().items() if not k in ('validation_fraction', 'stopping_rounds')}
+    model = LGBMEarlyStopping(
+        validation_fraction=validation_fraction,
+        stopping_rounds=stopping_rounds,
+        **params)
+
+    if not isinstance(pipe, Pipeline):
+        return model
+
+    pipe.set_params(**{name: model})
+    return pipe
+
+
+def halving_args(name: str, estimator, params: dict, cv_args: dict, kw: dict) -> dict:
+    """Adapt cv_args/kw (in place) for successive halving search, return cv_args
+
+    - resource param (eg 'n_estimators') renamed to 'name__param' and removed from params
+    - max_resources defaults to estimator's current value of resource param
+    - multi metric scoring reduced to refit metric, or first metric
+    """
+    resource = kw.get('resource', 'n_samples')
+
+    if not resource == 'n_samples':
+        if not resource.startswith(f'{name}__'):
+            resource = f'{name}__{resource}'
+
+        kw['resource'] = resource
+        params.pop(resource, None)
+
+        if not 'max_resources' in kw:
+            kw['max_resources'] = estimator.get_params()[resource]
+
+    cv_args = dict(cv_args)
+    scoring = cv_args.get('scoring', None)
+
+    if isinstance(scoring, dict):
+        refit = kw.pop('refit', None)
+        key = refit if isinstance(refit, str) and refit in scoring else list(scoring)[0]
+        cv_args['scoring'] = scoring[key]
+
+    return cv_args
+
+
+def _cross_validate_split(pipe, name: str, x, y, train, test, n_jobs: int, **cv_args) -> dict:
+    """cross_validate clone of pipe on single (train, test) split, with model's n_jobs set to this
+    worker's share of cores, without changing the caller's pipe
+    """
+    pipe = clone(pipe)
+    if f'{name}__n_jobs' in pipe.get_params():
+        pipe.set_params(**{f'{name}__n_jobs': n_jobs})
+
+    return cross_validate(pipe, x, y, cv=[(train, test)], error_score='raise', **cv_args)
+
+
+def make_memory(memory=None) -> Union[Memory, None]:
+    """Create joblib Memory for Pipeline transformer caching
+
+    Parameters
+    ----------
+    memory : bool | str | Path | Memory, optional
+        True for dir in system temp dir, or cache dir, or existing Memory, by default None
+
+    Returns
+    -------
+    Union[Memory, None]
+    """
+    if memory is None or memory is False:
+        return None
+
+    if isinstance(memory, Memory):
+        return memory
+
+    if memory is True:
+        memory = Path(tempfile.gettempdir()) / 'sklearn_cache'
+
+    return Memory(location=str(memory), verbose=0)
+
+
 def set_self(m, prnt=False, exclude=()):
     """Convenience func to assign an object's func's local vars to self"""
     if not isinstance(exclude, tuple):
@@ -860,6 +1126,37 @@ def avg_mase_smape(y_true, y_pred, h=1, **kw):
     return (smape(y_true, y_pred, h=h) + mase(y_true, y_pred, h=h))/2
 
 
+def horizon_scores(y_true, y_pred) -> pd.DataFrame:
+    """SMAPE, MASE and their average for every forecast horizon of a rolling origin backtest at once
+    Column h-1 of the inputs gives the same scores as `smape(y_true[:, h-1], y_pred[:, h-1], h=h)` etc,
+    except a sMAPE term where y_true and y_pred are both 0 counts as 0 error, instead of nan
+    Parameters
+    ----------
+    y_true : array-like
+        Ground truth values, shape (n_origins, horizon), rows in origin order
+    y_pred : array-like
+        Predicted values, same shape
+    Returns
+    -------
+    pd.DataFrame :
+        smape, mase, avg_mase_smape per horizon (1 to horizon)
+    """
+    y_true, y_pred = np.asarray(y_true, dtype=float), np.asarray(y_pred, dtype=float)
+    h = np.arange(1, y_true.shape[1] + 1)
+    errors = np.abs(y_true - y_pred)
+
+    denom = (np.abs(y_true) + np.abs(y_pred)) * h
+    smapes = np.mean(np.divide(2.0 * errors, denom, out=np.zeros_like(errors), where=denom > 0), axis=0)
+
+    # naive forecast error down each horizon's column, same as mase on that column
+    d = np.abs(np.diff(y_true, axis=0)).sum(axis=0) / (y_pred.shape[0] - 1)
+    mases = errors.mean(axis=0) / (d * h)
+
+    return pd.DataFrame(
+        dict(smape=smapes, mase=mases, avg_mase_smape=(smapes + mases) / 2),
+        index=pd.Index(h, name='horizon'))
+
+
 def reverse_pct(df, start_num, pct_col, num_col):
     """Convert % change back to number"""
     nums_out = []
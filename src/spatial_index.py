@@ -0,0 +1,263 @@
+"""
+Spatial index from model grid cells to the parquet files and row groups holding their rows
+
+Built once per dataset from parquet footers (plus the lat/lon columns of any row group holding
+more than one cell) and saved inside the dataset dir as `_spatial_index.parquet`, which dataset
+readers ignore. Reading one location's time series for every model is then a lookup in a small
+in memory table, followed by reads of only the matching row groups, without listing the
+dataset or opening the footer of every file.
+
+Paths in the index are relative to the dataset root, so an index built locally still works
+after the dataset is uploaded to s3.
+
+Examples
+--------
+>>> from src.spatial_index import SpatialIndex
+>>> index = SpatialIndex('data/parquet/rainfall')
+>>> df = index.read(lat=-33.86, lon=151.21, columns=['time', 'rain'])
+"""
+
+import json
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from . import loader
+from .__init__ import getlog
+from .convert import cell_cols
+
+log = getlog(__name__)
+
+index_name = '_spatial_index.parquet'
+
+
+class SpatialIndex(object):
+    """Grid cell -> (file, row group) lookup table for a rainfall parquet dataset"""
+
+    def __init__(
+            self,
+            path: Union[Path, str]=None,
+            storage_options: dict=None,
+            rebuild: bool=False,
+            check: bool=True):
+        """
+        Parameters
+        ----------
+        path : Union[Path, str], optional
+            dataset dir or url, by default data/parquet/rainfall
+        storage_options : dict, optional
+            credentials/endpoint for remote paths, by default None
+        rebuild : bool, optional
+            rebuild index even if saved one exists, by default False
+        check : bool, optional
+            rebuild saved index if dataset files changed since it was built, needs a listing of the
+            dataset, by default True
+        """
+        if path is None:
+            path = loader.p_dataset
+
+        self.storage_options = storage_options
+        fs, self.root = loader.get_filesystem(path, storage_options=storage_options)
+        self.root = self.root.rstrip('/')
+        self.fs = _arrow_fs(fs)
+        self.p_index = f'{self.root}/{index_name}'
+
+        self.df = None if rebuild else self.load()
+
+        if not self.df is None and check and not self.files == self._dataset_files():
+            log.warning('Dataset changed since spatial index was built, rebuilding.')
+            self.df = None
+
+        if self.df is None:
+            self.df = self.build()
+            self.save()
+
+    def _dataset(self) -> ds.Dataset:
+        return ds.dataset(self.root, format='parquet', partitioning='hive', filesystem=self.fs)
+
+    def _dataset_files(self) -> dict:
+        """Relative path: size of every file in dataset"""
+        files = self._dataset().files
+        return {
+            self._relative(info.path): info.size
+            for info in self.fs.get_file_info(files)}
+
+    def _relative(self, path: str) -> str:
+        return path[len(self.root):].lstrip('/')
+
+    def build(self) -> pd.DataFrame:
+        """Scan parquet footers (and lat/lon of multi cell row groups) into index table
+
+        Returns
+        -------
+        pd.DataFrame
+            one row per (cell, model, file, row group)
+        """
+        dset = self._dataset()
+        rows = []
+        n_read = 0
+
+        for fragment in dset.get_fragments():
+            path = self._relative(fragment.path)
+            model = loader.partition_keys(fragment.path, root=self.root).get('model')
+            md = fragment.metadata
+            has_model_col = 'model' in md.schema.names
+            pf = None
+
+            for i in range(md.num_row_groups):
+                rg = md.row_group(i)
+                stats = _cell_stats(rg, schema=md.schema)
+
+                # row group holds one cell (as written by convert.csv_to_parquet), no need to read it
+                if not stats is None and not has_model_col:
+                    rows.append(dict(zip(cell_cols, stats), model=model, path=path, row_group=i, n_rows=rg.num_rows))
+                    continue
+
+                if pf is None:
+                    pf = pq.ParquetFile(self.fs.open_input_file(fragment.path))
+
+                cols = cell_cols + (['model'] if has_model_col else [])
+                df = pf.read_row_group(i, columns=cols).to_pandas()
+                n_read += 1
+
+                if not has_model_col:
+                    df['model'] = model
+
+                for (*cell, cell_model), n in df.groupby(cell_cols + ['model'], observed=True).size().items():
+                    rows.append(dict(zip(cell_cols, cell), model=cell_model, path=path, row_group=i, n_rows=n))
+
+        df = pd.DataFrame(rows, columns=cell_cols + ['model', 'path', 'row_group', 'n_rows'])
+        log.info(
+            f'Built spatial index: {df[cell_cols].drop_duplicates().shape[0]:,.0f} cells, '
+            f'{df.path.nunique()} files, {len(df):,.0f} entries, {n_read} row groups read')
+
+        self.files = self._dataset_files()
+        return df
+
+    def save(self):
+        table = pa.Table.from_pandas(self.df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b'files': json.dumps(self.files).encode()})
+
+        with self.fs.open_output_stream(self.p_index) as file:
+            pq.write_table(table, file)
+
+    def load(self) -> pd.DataFrame:
+        """Load saved index, None if it doesn't exist"""
+        if self.fs.get_file_info(self.p_index).type == pafs.FileType.NotFound:
+            return None
+
+        with self.fs.open_input_file(self.p_index) as file:
+            table = pq.read_table(file)
+
+        self.files = json.loads(table.schema.metadata.get(b'files', b'{}'))
+        return table.to_pandas()
+
+    def lookup(self, lat: float, lon: float, models: list=None) -> pd.DataFrame:
+        """Index entries for cells containing point"""
+        df = self.df
+        mask = (df.lat_min <= lat) & (df.lat_max >= lat) & (df.lon_min <= lon) & (df.lon_max >= lon)
+
+        if not models is None:
+            mask &= df.model.isin(models)
+
+        return df[mask]
+
+    def read(
+            self,
+            lat: float,
+            lon: float,
+            models: list=None,
+            columns: list=None,
+            start=None,
+            end=None) -> pd.DataFrame:
+        """Read rows of every model's grid cell containing point, from matching row groups only
+
+        Parameters
+        ----------
+        lat : float
+        lon : float
+        models : list, optional
+            only these models, by default all
+        columns : list, optional
+            columns to return, by default all, model is always included
+        start : any, optional
+            keep time >= start, by default None
+        end : any, optional
+            keep time < end, by default None
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        df_index = self.lookup(lat=lat, lon=lon, models=models)
+        dfs = []
+
+        for path, df_path in df_index.groupby('path'):
+            with self.fs.open_input_file(f'{self.root}/{path}') as file:
+                pf = pq.ParquetFile(file)
+                names = pf.schema_arrow.names
+
+                # figshare's combined dataset still has original rain column name
+                rename = {'rain (mm/day)': 'rain'} if 'rain (mm/day)' in names else {}
+                inverse = {v: k for k, v in rename.items()}
+
+                want = names if columns is None else [inverse.get(c, c) for c in columns if not c == 'model']
+                read_cols = list(dict.fromkeys(
+                    [c for c in want if c in names] + cell_cols + ['time'] + (['model'] if 'model' in names else [])))
+
+                df = pf.read_row_groups(sorted(df_path.row_group.unique()), columns=read_cols) \
+                    .to_pandas() \
+                    .rename(columns=rename)
+
+            if not 'model' in df.columns:
+                df['model'] = df_path.model.iloc[0]
+
+            # row groups can hold other cells/models/times too
+            mask = (df.lat_min <= lat) & (df.lat_max >= lat) & (df.lon_min <= lon) & (df.lon_max >= lon) \
+                & df.model.isin(df_path.model.unique())
+
+            if not start is None:
+                mask &= df.time >= pd.Timestamp(start)
+            if not end is None:
+                mask &= df.time < pd.Timestamp(end)
+
+            out_cols = [rename.get(c, c) for c in want] + ['model']
+            dfs.append(df.loc[mask, list(dict.fromkeys(out_cols))])
+
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+
+        return pd.concat(dfs, ignore_index=True)
+
+
+def _arrow_fs(fs) -> pafs.FileSystem:
+    """Wrap fsspec filesystem for pyarrow, local if None"""
+    if fs is None:
+        return pafs.LocalFileSystem()
+
+    return pafs.PyFileSystem(pafs.FSSpecHandler(fs))
+
+
+def _cell_stats(rg, schema) -> tuple:
+    """(lat_min, lat_max, lon_min, lon_max) if row group statistics show a single grid cell"""
+    names = schema.names
+    vals = []
+
+    for col in cell_cols:
+        if not col in names:
+            return None
+
+        stats = rg.column(names.index(col)).statistics
+        if stats is None or not stats.has_min_max or not stats.min == stats.max:
+            return None
+
+        vals.append(stats.min)
+
+    return tuple(vals)
@@ -0,0 +1,294 @@
+"""
+Flattened array based inference backend for tree ensemble models
+
+Converts a fitted LightGBM, RandomForest, ExtraTrees, GradientBoosting or DecisionTree regressor
+(optionally the last step of a Pipeline) into padded node arrays, then predicts all rows and all
+trees at once with one vectorized numpy step per tree level. This skips the per call python and
+input validation overhead of the generic predict, which dominates for small shallow models.
+
+Compiled models are checked against the original model on load and the original is returned
+if predictions differ or the model type isn't supported.
+
+Examples
+--------
+>>> from src.tree_backend import compile_model
+>>> model = compile_model(joblib.load('model.joblib'))
+>>> model.predict(x)
+"""
+
+from typing import Union
+
+import numpy as np
+
+from .__init__ import getlog
+
+log = getlog(__name__)
+
+# lightgbm objectives where raw score is the prediction
+_identity_objectives = ('regression', 'regression_l1', 'huber', 'fair', 'quantile', 'mape')
+
+
+class UnsupportedModel(Exception):
+    """Model can't be flattened, use original predict"""
+    pass
+
+
+class FlatForest(object):
+    """Tree ensemble stored as (n_trees, max_nodes) arrays
+    - leaves point back to themselves, so every row can step max_depth times
+    - prediction = base_score + scale * sum(leaf values)
+    """
+
+    def __init__(self, trees: list, base_score: float = 0.0, scale: float = 1.0, float32: bool = False):
+        """
+        Parameters
+        ----------
+        trees : list
+            list of dicts of equal length node arrays: feature, threshold, left, right, value
+        base_score : float, optional
+            constant added to every prediction, by default 0.0
+        scale : float, optional
+            multiplier for summed leaf values, eg 1 / n_trees for averaging, by default 1.0
+        float32 : bool, optional
+            round inputs to float32 before comparing, as sklearn trees do, by default False
+        """
+        n_trees = len(trees)
+        max_nodes = max(len(t['feature']) for t in trees)
+
+        self.feature = np.zeros((n_trees, max_nodes), dtype=np.intp)
+        self.threshold = np.full((n_trees, max_nodes), np.inf)
+        self.left = np.tile(np.arange(max_nodes, dtype=np.intp), (n_trees, 1))
+        self.right = self.left.copy()
+        self.value = np.zeros((n_trees, max_nodes))
+
+        for i, t in enumerate(trees):
+            n = len(t['feature'])
+            leaf = t['left'] < 0
+            self.feature[i, :n] = np.where(leaf, 0, t['feature'])
+            self.threshold[i, :n] = np.where(leaf, np.inf, t['threshold'])
+            self.left[i, :n] = np.where(leaf, np.arange(n), t['left'])
+            self.right[i, :n] = np.where(leaf, np.arange(n), t['right'])
+            self.value[i, :n] = t['value']
+
+        self.max_depth = max(_depth(t['left'], t['right']) for t in trees)
+        self.base_score = base_score
+        self.scale = scale
+        self.float32 = float32
+        self.n_trees = n_trees
+
+        # flat copies with global node ids (tree * max_nodes + node) for fast 1d np.take lookups
+        offset = (np.arange(n_trees) * max_nodes)[:, None]
+        self._offset = offset.ravel()
+        self._feature = self.feature.ravel()
+        self._threshold = self.threshold.ravel()
+        self._left = (self.left + offset).ravel()
+        self._right = (self.right + offset).ravel()
+        self._value = self.value.ravel()
+
+    def predict(self, x: np.ndarray, chunk_rows: int = 2048) -> np.ndarray:
+        """Predict all rows, in chunks so working arrays stay cache sized"""
+        x = np.asarray(x, dtype=np.float64)
+        if self.float32:
+            x = x.astype(np.float32).astype(np.float64)
+
+        if x.shape[0] <= chunk_rows:
+            return self._predict(x)
+
+        return np.concatenate([
+            self._predict(x[i:i + chunk_rows]) for i in range(0, x.shape[0], chunk_rows)])
+
+    def _predict(self, x: np.ndarray) -> np.ndarray:
+        n_rows, n_features = x.shape
+        x_flat = np.ascontiguousarray(x).ravel()
+        row_offset = (np.arange(n_rows) * n_features)[:, None]
+        node = np.tile(self._offset, (n_rows, 1))
+
+        for _ in range(self.max_depth):
+            go_left = x_flat.take(row_offset + self._feature.take(node)) <= self._threshold.take(node)
+            node = np.where(go_left, self._left.take(node), self._right.take(node))
+
+        return self.base_score + self.scale * self._value.take(node).sum(axis=1)
+
+
+class CompiledModel(object):
+    """Drop in replacement for model.predict using FlatForest, keeps reference to original model"""
+
+    def __init__(self, original, forest: FlatForest, transform=None):
+        self.original = original
+        self.forest = forest
+        self.transform = transform
+
+    def predict(self, x) -> np.ndarray:
+        if not self.transform is None:
+            x = self.transform.transform(x)
+
+        return self.forest.predict(x)
+
+    def __repr__(self):
+        return f'CompiledModel({self.original!r})'
+
+
+def _depth(left: np.ndarray, right: np.ndarray) -> int:
+    """Max depth of tree from child arrays (-1 for leaf)"""
+    depth = np.zeros(len(left), dtype=int)
+    max_depth = 0
+
+    # nodes are numbered parent before child in both sklearn and our lightgbm flattening
+    for i in range(len(left)):
+        if left[i] >= 0:
+            depth[left[i]] = depth[right[i]] = depth[i] + 1
+            max_depth = max(max_depth, depth[i] + 1)
+
+    return max_depth
+
+
+def _sklearn_tree(tree) -> dict:
+    t = tree.tree_
+    if not t.n_outputs == 1 or not t.value.shape[2] == 1:
+        raise UnsupportedModel('Only single output regression trees are supported')
+
+    return dict(
+        feature=t.feature,
+        threshold=t.threshold,
+        left=t.children_left,
+        right=t.children_right,
+        value=t.value[:, 0, 0])
+
+
+def _lgbm_tree(structure: dict) -> dict:
+    """Flatten lightgbm nested tree dict into node arrays, parent before child"""
+    feature, threshold, left, right, value = [], [], [], [], []
+    stack = [(structure, None, None)]
+
+    while stack:
+        node, parent, side = stack.pop()
+        i = len(feature)
+
+        if not parent is None:
+            (left if side == 'left' else right)[parent] = i
+
+        if 'leaf_value' in node:
+            feature.append(-2)
+            threshold.append(np.inf)
+            left.append(-1)
+            right.append(-1)
+            value.append(node['leaf_value'])
+            continue
+
+        if not node['decision_type'] == '<=' or node.get('missing_type') == 'Zero':
+            raise UnsupportedModel(
+                f'Unsupported split: {node["decision_type"]}, missing_type={node.get("missing_type")}')
+
+        feature.append(node['split_feature'])
+        threshold.append(node['threshold'])
+        left.append(-1)
+        right.append(-1)
+        value.append(0.0)
+
+        # push right first so left child is numbered first
+        stack.append((node['right_child'], i, 'right'))
+        stack.append((node['left_child'], i, 'left'))
+
+    return dict(
+        feature=np.array(feature),
+        threshold=np.array(threshold, dtype=np.float64),
+        left=np.array(left),
+        right=np.array(right),
+        value=np.array(value, dtype=np.float64))
+
+
+def flatten(model) -> FlatForest:
+    """Convert fitted tree model to FlatForest
+
+    Raises
+    ------
+    UnsupportedModel
+        model type/settings not supported
+    """
+    name = type(model).__name__
+
+    if name in ('LGBMRegressor', 'Booster'):
+        booster = model.booster_ if hasattr(model, 'booster_') else model
+        dump = booster.dump_model()
+        objective = str(dump.get('objective', '')).split(' ')[0]
+
+        if not objective in _identity_objectives or not dump.get('num_tree_per_iteration', 1) == 1:
+            raise UnsupportedModel(f'Unsupported lightgbm objective: {objective}')
+
+        trees = [_lgbm_tree(t['tree_structure']) for t in dump['tree_info']]
+        scale = 1 / len(trees) if dump.get('average_output') else 1.0
+        return FlatForest(trees=trees, scale=scale)
+
+    if name in ('RandomForestRegressor', 'ExtraTreesRegressor'):
+        trees = [_sklearn_tree(est) for est in model.estimators_]
+        return FlatForest(trees=trees, scale=1 / len(trees), float32=True)
+
+    if name in ('DecisionTreeRegressor', 'ExtraTreeRegressor'):
+        return FlatForest(trees=[_sklearn_tree(model)], float32=True)
+
+    if name == 'GradientBoostingRegressor':
+        init = model.init_
+        if not (init == 'zero' or type(init).__name__ == 'DummyRegressor'):
+            raise UnsupportedModel('GradientBoostingRegressor init must be zero or DummyRegressor')
+
+        base_score = 0.0 if init == 'zero' else float(np.ravel(init.constant_)[0])
+        trees = [_sklearn_tree(est) for est in model.estimators_[:, 0]]
+        return FlatForest(trees=trees, base_score=base_score, scale=model.learning_rate, float32=True)
+
+    raise UnsupportedModel(f'Unsupported model type: {name}')
+
+
+def compile_model(
+        model,
+        x_check: np.ndarray = None,
+        n_check: int = 2000,
+        n_features: int = 25,
+        atol: float = 1e-6) -> Union[CompiledModel, object]:
+    """Return CompiledModel if it reproduces model's predictions, else original model
+
+    Parameters
+    ----------
+    model : any
+        fitted tree model, or Pipeline with tree model as last step
+    x_check : np.ndarray, optional
+        inputs to compare predictions on, default n_check random rows in documented 0-250 range
+    n_check : int, optional
+        random rows to check if x_check not given, by default 2000
+    n_features : int, optional
+        number of input features for random check rows, by default 25
+    atol : float, optional
+        max absolute difference allowed, by default 1e-6
+
+    Returns
+    -------
+    Union[CompiledModel, object]
+    """
+    final, transform = model, None
+    if type(model).__name__ == 'Pipeline':
+        final, transform = model.steps[-1][1], model[:-1]
+
+    try:
+        compiled = CompiledModel(original=model, forest=flatten(final), transform=transform)
+    except UnsupportedModel as e:
+        log.warning(f'Using original model predict: {e}')
+        return model
+
+    if x_check is None:
+        x_check = np.random.default_rng(0).uniform(0, 250, (n_check, n_features))
+
+    # include values exactly on split thresholds, where comparison precision matters most
+    f = compiled.forest
+    if transform is None:
+        internal = np.isfinite(f.threshold)
+        x_edge = np.tile(x_check[:1], (internal.sum(), 1))
+        x_edge[np.arange(len(x_edge)), f.feature[internal]] = f.threshold[internal]
+        x_check = np.vstack([x_check, x_edge])
+
+    diff = np.abs(compiled.predict(x_check) - model.predict(x_check)).max()
+
+    if diff > atol:
+        log.warning(f'Compiled model predictions differ by {diff:.2e}, using original model predict')
+        return model
+
+    log.info(f'Compiled {type(final).__name__} with {f.n_trees} trees, max depth {f.max_depth}, max diff {diff:.1e}')
+    return compiled
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import re
+
+import pytest
+
+from src import download as dl
+
+URL = 'https://example.com/file.zip'
+PART_SIZE = 16
+
+
+class FakeResponse(object):
+    """Minimal streamed partial content response for bytes start-end of content"""
+
+    def __init__(self, content: bytes, start: int, end: int):
+        self.content = content[start:end + 1]
+        self.status_code = 206
+        self.url = URL
+        self.headers = {
+            'content-range': f'bytes {start}-{end}/{len(content)}',
+            'etag': '"abc"'}
+
+    def iter_content(self, chunk_size: int=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@pytest.fixture
+def content() -> bytes:
+    return bytes(range(256)) * 4
+
+
+@pytest.fixture
+def fake_get(monkeypatch, content):
+    """Serve range requests from content, record ranges requested"""
+    requested = []
+
+    def _get(url, headers=None, **kw):
+        start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups())
+        requested.append((start, end))
+        return FakeResponse(content, start, end)
+
+    monkeypatch.setattr(dl, '_get', _get)
+    return requested
+
+
+def write_partial(p, content: bytes, done: list):
+    """Write .part file with ranges in done filled (rest zeros) and matching sidecar"""
+    data = bytearray(len(content))
+    for i in done:
+        start = i * PART_SIZE
+        data[start:start + PART_SIZE] = content[start:start + PART_SIZE]
+
+    p.with_name(f'{p.name}.part').write_bytes(bytes(data))
+
+    state = dict(url=URL, size=len(content), etag='"abc"', part_size=PART_SIZE, done=done)
+    p.with_name(f'{p.name}.part.json').write_text(json.dumps(state))
+
+
+def download(p, content: bytes):
+    dl._download(
+        url=URL,
+        p=p,
+        chunk_size=8,
+        workers=2,
+        part_size=PART_SIZE,
+        retries=1,
+        backoff=0,
+        md5=hashlib.md5(content).hexdigest())
+
+
+def test_resume_complete_part(tmp_path, content, fake_get):
+    """Every range finished in previous run, nothing fetched but whole file still verified"""
+    p = tmp_path / 'file.zip'
+    write_partial(p, content, done=list(range(len(content) // PART_SIZE)))
+
+    download(p, content)
+
+    assert p.read_bytes() == content
+    assert not p.with_name('file.zip.part').exists()
+    assert not p.with_name('file.zip.part.json').exists()
+    assert fake_get == [(0, 0)] # only first byte request for size
+
+
+def test_resume_partial(tmp_path, content, fake_get):
+    """Only unfinished ranges fetched, hash covers ranges read back from disk and fetched ones"""
+    p = tmp_path / 'file.zip'
+    n = len(content) // PART_SIZE
+    done = [i for i in range(n) if i % 3 == 0 or i == n - 1]
+    write_partial(p, content, done=done)
+
+    download(p, content)
+
+    assert p.read_bytes() == content
+    assert len(fake_get) == 1 + n - len(done)
+
+
+def test_bad_part_raises(tmp_path, content, fake_get):
+    """Corrupt range from previous run fails md5 and isn't kept for next resume"""
+    p = tmp_path / 'file.zip'
+    write_partial(p, content, done=list(range(len(content) // PART_SIZE)))
+
+    p_part = p.with_name('file.zip.part')
+    p_part.write_bytes(b'x' + p_part.read_bytes()[1:])
+
+    with pytest.raises(dl.ChecksumError):
+        download(p, content)
+
+    assert not p_part.exists()
+    assert not p.exists()